@@ -0,0 +1,16 @@
+"""Shared test fixtures. Being at the root of the repository, this file also
+puts the repository on sys.path, so the tests can import hoi4 and diff_logic
+under a plain pytest command."""
+
+import pytest
+
+
+@pytest.fixture
+def flag_data():
+    """A save whose blocks start, hold and end with flags (keys parsed with a
+    value of True), which both writers have to move after the other keys."""
+    return {
+        "country": {"leading_flag": True, "tag": "GER", "first": True, "second": True},
+        "between": {"a": "1", "flag": True, "b": "2"},
+        "12_flag": True,  # A flag at the very end of the file
+    }
@@ -1,6 +1,16 @@
 # In diff_logic.py
 
 from enum import Enum
+import heapq
+import marshal
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from hashlib import blake2b
+
+from hoi4.search import NUMBER_REGEX
+
+# Number of entries in the ranking of the largest numeric changes
+LARGEST_CHANGES = 200
 
 
 # Define the possible states for a diff node
@@ -15,19 +25,54 @@ class DiffNode:
     """
     Represents a node in the comparison tree.
     This class now has the same interface as TreeItem for compatibility with the model.
+
+    The tree is lazy: a modified dict or list starts without children, and
+    they are only diffed when fetchMore is called (by the model, when the node
+    is expanded in the view). The values are references into the two parsed
+    saves, never copies, and there can be a great many nodes, so they use
+    slots rather than a __dict__.
     """
 
-    def __init__(self, key, value_a=None, value_b=None, status=DiffStatus.UNCHANGED, parent=None):
+    __slots__ = ("key", "value_a", "value_b", "status", "change", "_parent", "_children",
+                 "_row", "_context", "_fetched")
+
+    def __init__(self, key, value_a=None, value_b=None, status=DiffStatus.UNCHANGED, parent=None,
+                 context=None):
         self.key = key
         self.value_a = value_a  # Value from the first file (old)
         self.value_b = value_b  # Value from the second file (new)
         self.status = status
         self._parent = parent  # Renamed from 'parent'
         self._children = []  # Renamed from 'children'
+        self._row = 0  # Our index in the parent's children, set by appendChild
+        self._context = context  # The DiffContext, for modified dicts and lists
+        self._fetched = context is None
+        # (delta, relative change) for a modified number, otherwise None
+        self.change = numeric_change(value_a, value_b) if status == DiffStatus.MODIFIED else None
 
     def appendChild(self, item):
+        item._row = len(self._children)
         self._children.append(item)
 
+    def canFetchMore(self):
+        """Returns True if this node's children have not been diffed yet."""
+        return not self._fetched
+
+    def fetchMore(self, progress=None):
+        """Diffs this node's children and returns them. The caller appends
+        them, so that a model can announce the new rows first."""
+        self._fetched = True
+        return self._context.diff_children(self, progress)
+
+    def change_counts(self):
+        """Returns the number of (added, removed, modified) changes anywhere
+        below a modified dict or list, if they have been counted (see
+        DiffContext.count_changes), or None. Never counts them itself, so it
+        is cheap enough for the view to call for every row."""
+        if self._context is None:
+            return None
+        return self._context.counted_changes(self.value_a, self.value_b)
+
     # --- ADD THE FOLLOWING METHODS TO MATCH TreeItem ---
     def child(self, row):
         if 0 <= row < len(self._children):
@@ -41,44 +86,604 @@ class DiffNode:
         return self._parent
 
     def row(self):
-        if self._parent:
-            # Find our own index within the parent's children list
-            return self._parent._children.index(self)
-        return 0
+        return self._row
     # --- END OF ADDED METHODS ---
 
 
-def compare_dicts(dict_a: dict, dict_b: dict):
+class SubtreeHasher:
+    """
+    Computes a digest of every dict and list in a parsed save, Merkle style: a
+    container's digest covers its keys and its children's digests. Digests are
+    cached, so each subtree is hashed once no matter how many comparisons it
+    is part of, and two subtrees are equal exactly when their digests are. As
+    with ==, the order of a dict's keys does not matter, while the order of a
+    list's elements does.
+    """
+
+    def __init__(self, root):
+        # Holding the root keeps every container alive, so the ids used as
+        # cache keys can never be reused by another object.
+        self.root = root
+        self._digests = {}
+
+    def digest(self, value):
+        """Returns the 16 byte digest of a dict or list."""
+        digest = self._digests.get(id(value))
+        if digest is None:
+            # Children are replaced by their digests (bytes, which no parsed
+            # value can be) and the result is serialised with marshal. Format
+            # version 2 is used because later versions write back-references
+            # for repeated objects, which would make equal data serialise
+            # differently depending on which strings happen to be shared.
+            if isinstance(value, dict):
+                items = [
+                    (key, self.digest(child) if isinstance(child, (dict, list)) else child)
+                    for key, child in sorted(value.items(), key=lambda item: item[0])
+                ]
+            else:
+                items = tuple(
+                    self.digest(child) if isinstance(child, (dict, list)) else child
+                    for child in value
+                )
+            data = marshal.dumps(items, 2)
+            digest = self._digests[id(value)] = blake2b(data, digest_size=16).digest()
+        return digest
+
+    def export_digests(self, containers):
+        """Returns the digests of a list of dicts and lists, such as those
+        yielded by iter_containers, as one bytes object."""
+        return b"".join(self.digest(container) for container in containers)
+
+    def import_digests(self, containers, digests):
+        """Caches digests returned by export_digests for a list of equal
+        containers, so that a subtree can be hashed in another process."""
+        for i, container in enumerate(containers):
+            self._digests[id(container)] = digests[i * 16:(i + 1) * 16]
+
+    def same_as(self, value, other, other_hasher):
+        """Returns True if a value in this hasher's save is equal to a value in
+        another save, comparing digests rather than walking the subtrees."""
+        if isinstance(value, (dict, list)) and type(value) is type(other):
+            return self.digest(value) == other_hasher.digest(other)
+        return value == other
+
+
+class DiffContext:
     """
-    Recursively compares two dictionaries and returns a tree of DiffNode objects.
+    The state shared by all the nodes of one comparison: the hashers of both
+    saves, whether unchanged entries are left out of the tree, and a cache of
+    the change counts of modified branches.
     """
-    # The root DiffNode now has a key to match TreeItem's structure
+
+    def __init__(self, hasher_a, hasher_b, changes_only=False):
+        self.hasher_a = hasher_a
+        self.hasher_b = hasher_b
+        self.changes_only = changes_only
+        self._counts = {}
+        self._largest = {}
+
+    def pairs(self, value_a, value_b):
+        """Pairs up the children of two dicts or two lists (see pair_items)."""
+        return pair_items(value_a, value_b, self.hasher_a, self.hasher_b)
+
+    def diff_children(self, parent, progress=None):
+        """Returns a list of DiffNodes for the children of a modified node.
+        Their own children are left to be fetched later. If given, progress is
+        called after each child with the number done and the number of
+        children."""
+        value_a, value_b = parent.value_a, parent.value_b
+        if isinstance(value_a, dict):
+            total = len(set(value_a) | set(value_b))
+        else:
+            total = len(value_a) + len(value_b)  # An upper bound on the pairs
+
+        children = []
+        for done, (key, child_a, child_b, status) in enumerate(self.pairs(value_a, value_b), 1):
+            if progress is not None:
+                progress(done, total)
+            # Lists are diffed to show only the elements that actually changed
+            if status == DiffStatus.UNCHANGED and (self.changes_only or isinstance(value_a, list)):
+                continue
+            context = None
+            if status == DiffStatus.MODIFIED and is_same_container(child_a, child_b):
+                context = self
+            children.append(DiffNode(key, child_a, child_b, status, parent=parent, context=context))
+        return children
+
+    def count_changes(self, value_a, value_b, check=None):
+        """Returns the number of (added, removed, modified) entries anywhere
+        below two modified dicts or lists, without creating any DiffNodes. A
+        whole added or removed subtree counts as one change, and so does a
+        modified value that is not itself a dict or list. If given, check is
+        called with no arguments before each branch is counted, and can raise
+        to stop the count."""
+        key = (id(value_a), id(value_b))  # The hashers keep both trees alive
+        counts = self._counts.get(key)
+        if counts is None:
+            if check is not None:
+                check()
+            added = removed = modified = 0
+            for _, child_a, child_b, status in self.pairs(value_a, value_b):
+                if status == DiffStatus.ADDED:
+                    added += 1
+                elif status == DiffStatus.REMOVED:
+                    removed += 1
+                elif status == DiffStatus.MODIFIED:
+                    if is_same_container(child_a, child_b):
+                        child_counts = self.count_changes(child_a, child_b, check)
+                        added += child_counts[0]
+                        removed += child_counts[1]
+                        modified += child_counts[2]
+                    else:
+                        modified += 1
+            counts = self._counts[key] = (added, removed, modified)
+        return counts
+
+    def counted_changes(self, value_a, value_b):
+        """Returns the counts count_changes has already found for two dicts or
+        lists, which includes every branch below those it was called with, or
+        None if they have not been counted."""
+        return self._counts.get((id(value_a), id(value_b)))
+
+    def largest_changes(self, count=LARGEST_CHANGES, check=None):
+        """Returns the (path, value_a, value_b) of the modified numbers with the
+        largest absolute change anywhere in the comparison, largest first (see
+        rank_changes). The ranking is cached. If given, check is called with no
+        arguments before each change is ranked, and can raise to stop."""
+        if count not in self._largest:
+            changes = iter_changes(
+                self.hasher_a.root, self.hasher_b.root, self.hasher_a, self.hasher_b
+            )
+            if check is not None:
+                changes = _checked(changes, check)
+            self._largest[count] = rank_changes(changes, count)
+        return self._largest[count]
+
+
+def _checked(iterable, check):
+    """Yields the items of an iterable, calling check before each one."""
+    for item in iterable:
+        check()
+        yield item
+
+
+def hash_sections(hasher_a, hasher_b, processes, progress=None, counts=None):
+    """
+    Hashes the top-level sections that two saves both have in a pool of
+    processes, and caches the digests of their dicts and lists in the saves'
+    SubtreeHashers. The sections are sent to the processes a few at a time,
+    as processes become free, each as marshal data of the whole nested
+    section, which costs about as much as hashing it here: the pool was
+    slower than a single process on every save measured, so only the
+    command line uses it, with -j. If a dict is given as counts, the
+    changes in each section are counted too, and the counts of every branch
+    are added to it, as DiffContext.count_changes caches them. If given,
+    progress is called with the number of sections done and the number of
+    sections. If it raises, the pool is shut down without waiting for the
+    sections being hashed.
+    """
+    root_a, root_b = hasher_a.root, hasher_b.root
+    keys = [key for key in root_a.keys() & root_b.keys()
+            if is_same_container(root_a[key], root_b[key])]
+    # The largest sections go first, so that no process is left with a
+    # large one at the end
+    keys.sort(key=lambda key: len(root_a[key]) + len(root_b[key]), reverse=True)
+
+    sections = iter(keys)
+    pending = set()
+    done = 0
+    executor = ProcessPoolExecutor(processes)
+    try:
+        while True:
+            for key in islice(sections, 2 * processes - len(pending)):
+                pending.add(executor.submit(
+                    _hash_section, key, marshal.dumps(root_a[key], 2),
+                    marshal.dumps(root_b[key], 2), counts is not None
+                ))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key, digests_a, digests_b, section_counts = future.result()
+                containers_a = list(iter_containers(root_a[key]))
+                containers_b = list(iter_containers(root_b[key]))
+                hasher_a.import_digests(containers_a, digests_a)
+                hasher_b.import_digests(containers_b, digests_b)
+                for (i, j), branch_counts in section_counts.items():
+                    counts[(id(containers_a[i]), id(containers_b[j]))] = branch_counts
+                done += 1
+                if progress is not None:
+                    progress(done, len(keys))
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+
+def _hash_section(key, data_a, data_b, count):
+    """Runs in a worker process for hash_sections, and returns the key, the
+    digests of both sections and, if count is True, the change counts of
+    their branches, keyed by the positions of the branches' dicts or lists
+    in the order of iter_containers."""
+    section_a, section_b = marshal.loads(data_a), marshal.loads(data_b)
+    hasher_a, hasher_b = SubtreeHasher(section_a), SubtreeHasher(section_b)
+    containers_a = list(iter_containers(section_a))
+    containers_b = list(iter_containers(section_b))
+    counts = {}
+    if count:
+        context = DiffContext(hasher_a, hasher_b)
+        context.count_changes(section_a, section_b)
+        positions_a = {id(container): i for i, container in enumerate(containers_a)}
+        positions_b = {id(container): i for i, container in enumerate(containers_b)}
+        counts = {
+            (positions_a[id_a], positions_b[id_b]): branch_counts
+            for (id_a, id_b), branch_counts in context._counts.items()
+        }
+    return key, hasher_a.export_digests(containers_a), hasher_b.export_digests(containers_b), counts
+
+
+def compare_dicts(dict_a: dict, dict_b: dict, hasher_a=None, hasher_b=None, progress=None,
+                  changes_only=False, processes=None):
+    """
+    Compares two dictionaries and returns a lazy tree of DiffNode objects: only
+    the top-level keys are compared here, and the children of modified keys
+    are compared when the nodes are fetched (see DiffNode.fetchMore).
+    Unchanged subtrees are detected by comparing digests from each save's
+    SubtreeHasher; pass the hashers in to reuse digests across comparisons.
+    If changes_only is True, no nodes are created for unchanged entries.
+    If processes is more than 1, the top-level sections are first hashed, and
+    their changes counted, in that many processes (see hash_sections).
+    If given, progress is called with the number of top-level keys compared
+    so far and the total number of top-level keys.
+    """
+    context = DiffContext(
+        hasher_a or SubtreeHasher(dict_a), hasher_b or SubtreeHasher(dict_b), changes_only
+    )
+    if processes is not None and processes > 1:
+        hash_sections(context.hasher_a, context.hasher_b, processes, progress, context._counts)
+        progress = None  # The top level is quick to compare after that
+
+    return _diff_root(dict_a, dict_b, context, progress)
+
+
+def rebuild_diff_tree(diff_root, changes_only):
+    """
+    Returns a new tree for the comparison diff_root belongs to, with or
+    without nodes for unchanged entries (see compare_dicts). The comparison's
+    DiffContext is reused with its digests, change counts and ranking, so
+    only the top level is compared again. The old tree should not be
+    expanded any further afterwards.
+    """
+    context = diff_root._context
+    context.changes_only = changes_only
+    return _diff_root(diff_root.value_a, diff_root.value_b, context)
+
+
+def _diff_root(dict_a, dict_b, context, progress=None):
+    """Returns the root DiffNode of a comparison, with the top level diffed."""
+    # The root DiffNode now has a key to match TreeItem's structure. It holds
+    # both dicts, so the comparison can be redone with other options.
+    root_node = DiffNode("__root__", dict_a, dict_b, DiffStatus.MODIFIED, context=context)
+    for node in root_node.fetchMore(progress):
+        root_node.appendChild(node)
+    return root_node
+
+
+def largest_changes_tree(diff_root, count=LARGEST_CHANGES):
+    """Returns a flat tree of DiffNodes, keyed by their dotted paths, for the
+    largest numeric changes of the comparison diff_root belongs to."""
     root_node = DiffNode("__root__")
+    for path, value_a, value_b in diff_root._context.largest_changes(count):
+        root_node.appendChild(DiffNode(
+            ".".join(path), value_a, value_b, DiffStatus.MODIFIED, parent=root_node
+        ))
+    return root_node
 
-    all_keys = sorted(list(set(dict_a.keys()) | set(dict_b.keys())))
 
-    for key in all_keys:
-        value_a = dict_a.get(key)
-        value_b = dict_b.get(key)
+def rank_changes(changes, count=LARGEST_CHANGES):
+    """Takes (path, status, value_a, value_b) tuples, as yielded by
+    iter_changes, and returns the (path, value_a, value_b) of the modified
+    numbers with the largest absolute change, largest first. The ranking
+    keeps a heap of the top entries rather than sorting them all."""
+    changes = (
+        (path, value_a, value_b, numeric_change(value_a, value_b))
+        for path, status, value_a, value_b in changes
+        if status == DiffStatus.MODIFIED
+    )
+    return [
+        (path, value_a, value_b) for path, value_a, value_b, _ in heapq.nlargest(
+            count, (change for change in changes if change[3] is not None),
+            key=lambda change: abs(change[3][0])
+        )
+    ]
+
+
+def numeric_change(value_a, value_b):
+    """Returns (delta, relative change) if both values are numbers, or None.
+    The relative change is None when the old value is zero."""
+    if not (isinstance(value_a, str) and isinstance(value_b, str)
+            and NUMBER_REGEX.fullmatch(value_a) and NUMBER_REGEX.fullmatch(value_b)):
+        return None
+    number_a, number_b = float(value_a), float(value_b)
+    delta = number_b - number_a
+    return delta, (delta / abs(number_a) if number_a else None)
+
+
+def iter_containers(value):
+    """Yields a dict or list and every dict and list below it, in an order
+    that only depends on the structure of the value."""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        yield value
+        children = value.values() if isinstance(value, dict) else value
+        stack.extend(child for child in children if isinstance(child, (dict, list)))
+
 
-        node = DiffNode(key, value_a, value_b, parent=root_node)
+def iter_changes(value_a, value_b, hasher_a, hasher_b, path=()):
+    """
+    Yields a (path, status, value_a, value_b) tuple for every added, removed
+    or modified entry below two dicts or two lists, where path is the tuple of
+    keys leading to the entry. Modified dicts and lists are descended into
+    rather than reported themselves, and unchanged subtrees are skipped
+    using the hashers' digests.
+    """
+    for key, child_a, child_b, status in pair_items(value_a, value_b, hasher_a, hasher_b):
+        if status == DiffStatus.UNCHANGED:
+            continue
+        if status == DiffStatus.MODIFIED and is_same_container(child_a, child_b):
+            yield from iter_changes(child_a, child_b, hasher_a, hasher_b, path + (key,))
+        else:
+            yield path + (key,), status, child_a, child_b
+
+
+def iter_change_records(dict_a, dict_b, hasher_a=None, hasher_b=None):
+    """
+    Yields a dict for every change between two parsed saves, as found by
+    iter_changes, with the entry's "path" (a list of keys), its "status"
+    ("added", "removed" or "modified") and its "old" and "new" values.
+    """
+    hasher_a = hasher_a or SubtreeHasher(dict_a)
+    hasher_b = hasher_b or SubtreeHasher(dict_b)
+    for path, status, value_a, value_b in iter_changes(dict_a, dict_b, hasher_a, hasher_b):
+        yield {"path": list(path), "status": status.name.lower(), "old": value_a, "new": value_b}
+
+
+def iter_patch(dict_a, dict_b, hasher_a=None, hasher_b=None):
+    """
+    Yields the RFC 6902 JSON Patch operations that turn dict_a into dict_b,
+    one at a time. Operations are meant to be applied in order, so list
+    indices are positions in the list as the earlier operations left it.
+    """
+    hasher_a = hasher_a or SubtreeHasher(dict_a)
+    hasher_b = hasher_b or SubtreeHasher(dict_b)
+    return _iter_patch(dict_a, dict_b, hasher_a, hasher_b, "")
+
+
+def _iter_patch(value_a, value_b, hasher_a, hasher_b, pointer):
+    """Yields the patch operations below two dicts or two lists, the
+    container at the JSON pointer pointer."""
+    is_list = isinstance(value_a, list)
+    position = 0  # For lists, where the next element is in the patched list
+    for key, child_a, child_b, status in pair_items(value_a, value_b, hasher_a, hasher_b):
+        if is_list:
+            child_pointer = f"{pointer}/{position}"
+        else:
+            child_pointer = f"{pointer}/{_escape_pointer(key)}"
 
+        if status == DiffStatus.ADDED:
+            yield {"op": "add", "path": child_pointer, "value": child_b}
+        elif status == DiffStatus.REMOVED:
+            yield {"op": "remove", "path": child_pointer}
+            continue  # The next element moves into this position
+        elif status == DiffStatus.MODIFIED:
+            if is_same_container(child_a, child_b):
+                yield from _iter_patch(child_a, child_b, hasher_a, hasher_b, child_pointer)
+            else:
+                yield {"op": "replace", "path": child_pointer, "value": child_b}
+        position += 1
+
+
+def _escape_pointer(key):
+    """Escapes a key for use in a JSON pointer."""
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def build_timeline(saves):
+    """
+    Takes parsed saves in chronological order and returns a dict mapping the
+    dotted path of every entry that changed to the indices of the saves in
+    which it changed, compared with the save before. The saves can be any
+    iterable, such as a generator loading them one by one: each save is
+    hashed once and reused for both comparisons it is part of, and at most
+    two saves are held at a time.
+    """
+    timeline = {}
+    previous = None
+    for i, save in enumerate(saves):
+        hasher = SubtreeHasher(save)
+        if previous is not None:
+            for path, _, _, _ in iter_changes(previous.root, save, previous, hasher):
+                timeline.setdefault(".".join(path), []).append(i)
+        previous = hasher
+    return timeline
+
+
+def pair_items(value_a, value_b, hasher_a, hasher_b):
+    """Pairs up the children of two dicts (see pair_dict_items) or two lists
+    (see pair_list_items)."""
+    if isinstance(value_a, dict):
+        return pair_dict_items(value_a, value_b, hasher_a, hasher_b)
+    return pair_list_items(value_a, value_b, hasher_a, hasher_b)
+
+
+def is_same_container(value_a, value_b):
+    """Returns True if both values are dicts or both are lists."""
+    return isinstance(value_a, (dict, list)) and type(value_a) is type(value_b)
+
+
+def pair_dict_items(dict_a, dict_b, hasher_a, hasher_b):
+    """
+    Yields a (key, value_a, value_b, status) tuple for every key of two dicts,
+    in sorted key order. A missing value is None.
+    """
+    for key in sorted(set(dict_a.keys()) | set(dict_b.keys())):
+        value_a = dict_a.get(key)
+        value_b = dict_b.get(key)
         if key not in dict_a:
-            node.status = DiffStatus.ADDED
+            status = DiffStatus.ADDED
         elif key not in dict_b:
-            node.status = DiffStatus.REMOVED
-        elif value_a != value_b:
-            node.status = DiffStatus.MODIFIED
-            if isinstance(value_a, dict) and isinstance(value_b, dict):
-                # The recursive call now returns a DiffNode, so we take its children
-                child_root = compare_dicts(value_a, value_b)
-                node._children = child_root._children  # Assign to _children
-        # No UNCHANGED status needed in the diff tree, we will filter them later
+            status = DiffStatus.REMOVED
+        elif not hasher_a.same_as(value_a, value_b, hasher_b):
+            status = DiffStatus.MODIFIED
         else:
-            # For simplicity, we can skip unchanged nodes, or handle them
-            # Here we will add them for completeness
-            node.status = DiffStatus.UNCHANGED
+            status = DiffStatus.UNCHANGED
+        yield key, value_a, value_b, status
+
+
+# Elements of a list are matched by the first of these fields that every
+# element has, with a different value in each element
+IDENTITY_FIELDS = ("id", "name")
+
+# Lists needing more edits than this are compared position by position. The
+# search takes time and memory growing with the square of the edits, and runs
+# on the GUI thread when a branch is expanded.
+MAX_EDIT_DISTANCE = 200
+
+
+def pair_list_items(list_a, list_b, hasher_a, hasher_b):
+    """
+    Yields a (key, value_a, value_b, status) tuple for the elements of two
+    lists, keyed "[i]" by their position in the new list (or the old one, for
+    removed elements).
+
+    When the elements are dicts with an identity field (see IDENTITY_FIELDS),
+    elements with the same identity are paired up, so changes inside an
+    element show up as a modification of that element only. Otherwise the
+    lists are aligned with a Myers diff of the elements' digests, and removed
+    elements directly replaced by added ones are reported as modified.
+    """
+    field = _identity_field(list_a, list_b)
+    if field is None:
+        seq_a = [_identity(value, hasher_a) for value in list_a]
+        seq_b = [_identity(value, hasher_b) for value in list_b]
+    else:
+        seq_a = [_identity(value[field], hasher_a) for value in list_a]
+        seq_b = [_identity(value[field], hasher_b) for value in list_b]
+
+    removed, added = [], []
+    for tag, i, j in _edit_script(seq_a, seq_b) + [("end", None, None)]:
+        if tag == "delete":
+            removed.append(i)
+            continue
+        if tag == "insert":
+            added.append(j)
+            continue
+
+        # Flush the run of removals and additions before this point
+        if field is None:
+            paired = min(len(removed), len(added))
+            for i_a, j_b in zip(removed, added):
+                yield f"[{j_b}]", list_a[i_a], list_b[j_b], DiffStatus.MODIFIED
+            removed, added = removed[paired:], added[paired:]
+        for i_a in removed:
+            yield f"[{i_a}]", list_a[i_a], None, DiffStatus.REMOVED
+        for j_b in added:
+            yield f"[{j_b}]", None, list_b[j_b], DiffStatus.ADDED
+        removed, added = [], []
+
+        if tag == "equal":
+            value_a, value_b = list_a[i], list_b[j]
+            if field is None or hasher_a.same_as(value_a, value_b, hasher_b):
+                yield f"[{j}]", value_a, value_b, DiffStatus.UNCHANGED
+            else:
+                yield f"[{j}]", value_a, value_b, DiffStatus.MODIFIED
 
-        root_node.appendChild(node)
 
-    return root_node
\ No newline at end of file
+def _identity(value, hasher):
+    """Returns something hashable that is equal for equal values."""
+    return hasher.digest(value) if isinstance(value, (dict, list)) else value
+
+
+def _identity_field(list_a, list_b):
+    """Returns the field that identifies the elements of both lists, if any."""
+    values = list_a + list_b
+    if not values or not all(isinstance(value, dict) for value in values):
+        return None
+    for field in IDENTITY_FIELDS:
+        if not all(field in value for value in values):
+            continue
+        for items in (list_a, list_b):
+            identities = [str(value[field]) for value in items]
+            if len(set(identities)) != len(identities):
+                break
+        else:
+            return field
+    return None
+
+
+def _edit_script(seq_a, seq_b):
+    """
+    Returns the shortest edit script turning seq_a into seq_b, found with
+    Myers' O((N+M)D) algorithm, as a list of ("equal", i, j), ("delete", i,
+    None) and ("insert", None, j) tuples in order. If the sequences differ by
+    more than MAX_EDIT_DISTANCE edits, elements are aligned by position.
+    """
+    n, m = len(seq_a), len(seq_b)
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, MAX_EDIT_DISTANCE) + 1):
+        # Each round only reads the paths of the one before, so it starts a
+        # new dict rather than copying the old one into the trace
+        trace.append(v)
+        previous, v = v, {}
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and previous[k - 1] < previous[k + 1]):
+                x = previous[k + 1]
+            else:
+                x = previous[k - 1] + 1
+            y = x - k
+            while x < n and y < m and seq_a[x] == seq_b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+
+    # Too different for a minimal script to be worth finding
+    script = []
+    for i in range(min(n, m)):
+        if seq_a[i] == seq_b[i]:
+            script.append(("equal", i, i))
+        else:
+            script += [("delete", i, None), ("insert", None, i)]
+    script += [("delete", i, None) for i in range(m, n)]
+    script += [("insert", None, j) for j in range(n, m)]
+    return script
+
+
+def _backtrack(trace, x, y):
+    """Walks back through the furthest-reaching paths recorded by
+    _edit_script to recover the edit script that ends at (x, y)."""
+    script = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            script.append(("equal", x - 1, y - 1))
+            x -= 1
+            y -= 1
+        if d > 0:
+            if x == prev_x:
+                script.append(("insert", None, y - 1))
+            else:
+                script.append(("delete", x - 1, None))
+        x, y = prev_x, prev_y
+    script.reverse()
+    return script
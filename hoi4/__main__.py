@@ -1,21 +1,177 @@
+import os
+import re
+import sys
 import json
+import contextlib
 import argparse
-from hoi4.parse import load_as_text, load_as_dict
+from hoi4.parse import load_as_text, load_as_dict, probe
+from hoi4.binary import write_binary_hoi4, patch_binary_hoi4
+from hoi4.search import SearchIndex, compile_search
+from hoi4.export import write_json, write_hoi4, open_export, export_compression
+from diff_logic import build_timeline, hash_sections, iter_change_records, iter_patch, SubtreeHasher
 
 parser = argparse.ArgumentParser(description="Parse HoI4 save files.")
-parser.add_argument("mode", choices=["binary2plain", "hoi42json"])
-parser.add_argument("-i", "--input", help="The input file")
-parser.add_argument("-o", "--output", help="The output file")
+parser.add_argument("mode", choices=["binary2plain", "hoi42json", "hoi42binary", "search",
+                                     "timeline", "diff", "set", "probe"])
+parser.add_argument("-i", "--input", nargs="+", help="The input file (for timeline "
+                    "mode, the input files in chronological order; for diff "
+                    "mode, the old and the new file; for probe mode, any number of files)")
+parser.add_argument("-o", "--output", help="The output file, compressed if it ends in "
+                    ".gz, .bz2 or .xz")
+parser.add_argument("-q", "--query", help="The query for search mode, e.g. "
+                    "'key:manpower value>1000000 path:countries.*.'")
+parser.add_argument("-f", "--format", choices=["pretty", "compact", "ndjson", "text", "patch"],
+                    help="The output format. For hoi42json mode: pretty (the default), "
+                    "compact, or ndjson for one top-level entry per line. For search "
+                    "mode: the matching paths and values (the default), or the "
+                    "matching subtrees as text (plain HOI4 text) or in a JSON format. For diff "
+                    "mode: patch (the default) for an RFC 6902 JSON Patch, or ndjson "
+                    "for one change record per line. For probe mode: one tab-separated "
+                    "line per file (the default), or ndjson")
+parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="The number of processes to hash the top-level sections "
+                    "with in diff mode (default 1), which only pays off for very "
+                    "large saves")
+parser.add_argument("-p", "--path", help="For set mode, the dotted path of the value to "
+                    "change in a binary save, e.g. countries.GER.stability")
+parser.add_argument("-v", "--value", help="For set mode, the new value")
+parser.add_argument("--stats", action="store_true", help="Print the time spent waiting "
+                    "for binary saves to be read and decoding them")
 args = parser.parse_args()
 
+# Timings of loading binary saves, for --stats
+stats = {} if args.stats else None
+
+
+def write_lines(lines):
+    """Writes lines of output to the output file, or prints them."""
+    if args.output:
+        with open_output() as f:
+            f.writelines(line + "\n" for line in lines)
+    else:
+        for line in lines:
+            print(line)
+
+
+def open_output(binary=False):
+    """Opens the output file for writing, compressed according to its
+    extension, or returns standard output."""
+    if args.output:
+        return open_export(args.output, export_compression(args.output), binary)
+    return contextlib.nullcontext(sys.stdout.buffer if binary else sys.stdout)
+
+
+def patch_lines(operations):
+    """Yields the lines of a JSON array of patch operations, one per line."""
+    yield "["
+    separator = ""
+    for operation in operations:
+        yield separator + json.dumps(operation)
+        separator = ","
+    yield "]"
+
 
 if args.mode == "binary2plain":
-    text = load_as_text(args.input)
-    with open(args.output, "w") as f:
+    text = load_as_text(args.input[0], stats=stats)
+    with open_output() as f:
         f.write(text)
 
 
 elif args.mode == "hoi42json":
-    d = load_as_dict(args.input)
-    with open(args.output, "w") as f:
-        json.dump(d, f, indent=4)
\ No newline at end of file
+    if args.format in ("text", "patch"):
+        parser.error("hoi42json mode writes pretty, compact or ndjson output")
+    d = load_as_dict(args.input[0], stats=stats)
+    with open_output() as f:
+        write_json(d, f, args.format or "pretty")
+
+
+elif args.mode == "hoi42binary":
+    # Plain text saves are parsed first, and binary saves are normalised
+    d = load_as_dict(args.input[0], stats=stats)
+    with open_output(binary=True) as f:
+        write_binary_hoi4(d, f)
+
+
+elif args.mode == "search":
+    if args.format == "patch":
+        parser.error("search mode writes text, pretty, compact or ndjson output")
+    if args.query is None:
+        parser.error("search mode needs a query (-q)")
+    try:
+        query = compile_search(args.query)
+    except (re.error, ValueError) as e:
+        parser.error(f"invalid query: {e}")
+    strings = {}
+    d = load_as_dict(args.input[0], strings, stats=stats)
+    index = SearchIndex(d, strings)
+    matches = index.search(query)
+    if args.format is None:
+        lines = []
+        for node_id in sorted(matches):
+            value = index.value(node_id)
+            path = index.path(node_id)
+            lines.append(path if value is None else f"{path} = {value}")
+        write_lines(lines)
+    else:
+        # Write the matching subtrees, in their place in the save
+        selected = index.select(d, matches)
+        with open_output() as f:
+            if args.format == "text":
+                write_hoi4(selected, f)
+            else:
+                write_json(selected, f, args.format)
+
+
+elif args.mode == "timeline":
+    # The saves are loaded one at a time as the timeline is built
+    timeline = build_timeline(load_as_dict(path, stats=stats) for path in args.input)
+    names = [os.path.basename(path) for path in args.input]
+    write_lines(
+        f"{path}: {', '.join(names[i] for i in indices)}"
+        for path, indices in sorted(timeline.items())
+    )
+
+
+elif args.mode == "diff":
+    if len(args.input) != 2:
+        parser.error("diff mode takes two input files")
+    if args.format in ("pretty", "compact", "text"):
+        parser.error("diff mode writes patch or ndjson output")
+    # Both saves share one table of strings, so repeated ones are stored once
+    strings = {}
+    dict_a = load_as_dict(args.input[0], strings, stats=stats)
+    dict_b = load_as_dict(args.input[1], strings, stats=stats)
+    # The changes are written out as they are found, with the sections
+    # hashed in parallel first if asked to
+    hashers = SubtreeHasher(dict_a), SubtreeHasher(dict_b)
+    if args.jobs > 1:
+        hash_sections(*hashers, args.jobs)
+    if args.format == "ndjson":
+        write_lines(json.dumps(record) for record in iter_change_records(dict_a, dict_b, *hashers))
+    else:
+        write_lines(patch_lines(iter_patch(dict_a, dict_b, *hashers)))
+
+
+elif args.mode == "set":
+    # The save is changed in place, without decoding the rest of it
+    old_value = patch_binary_hoi4(args.input[0], args.path.split("."), args.value)
+    print(f"{args.path}: {old_value} -> {args.value}")
+
+
+elif args.mode == "probe":
+    if args.format not in (None, "ndjson"):
+        parser.error("probe mode writes tab-separated or ndjson output")
+    # Only the start of each save is read, for the metadata at its top
+    metadata = ((path, probe(path)) for path in args.input)
+    if args.format == "ndjson":
+        write_lines(json.dumps({"path": path, **values}) for path, values in metadata)
+    else:
+        write_lines(
+            "\t".join([path, *("" if value is None else str(value) for value in values.values())])
+            for path, values in metadata
+        )
+
+
+if stats is not None:
+    print(f"Waiting for binary saves to be read: {stats.get('io_wait', 0):.2f}s, "
+          f"decoding them: {stats.get('decode', 0):.2f}s", file=sys.stderr)
@@ -1,22 +1,143 @@
+import io
+import mmap
 import re
+import time
 from datetime import datetime, timedelta
-from struct import unpack
+from struct import Struct, error as StructError, unpack
 from hoi4.data import TOKENS
+from hoi4.plain import NEEDS_QUOTES_REGEX
+from hoi4.readahead import ReadAheadReader, READ_AHEAD_BUFFERS, READ_AHEAD_BUFFER_SIZE
 
 
-def parse_binary_hoi4(f):
+# Keys whose large integer values are hours since the start of the calendar,
+# decoded into date strings by decorate
+DATE_KEYS = ["date", "expire", "trade", "next_weather_change"]
+FIRST_DATE_HOURS = 43808760  # Smaller values are left as they are
+
+# Token ids that are followed by a typed value rather than being a name
+VALUE_TYPES = {12, 13, 14, 15, 20, 23, 359, 668}
+
+# The name of every token id that is not a value type, for the decoder
+NAMES = {number: name for number, name in TOKENS.items() if number not in VALUE_TYPES}
+
+# The id of every name in TOKENS, for the encoder. The first id wins if a
+# name appears more than once.
+TOKEN_IDS = {}
+for number, name in NAMES.items():
+    TOKEN_IDS.setdefault(name, number)
+
+WRITE_BUFFER_SIZE = 1 << 20  # Bytes collected before they are written
+
+TOKEN = Struct("<H")
+EQUALS, OPEN, CLOSE = TOKEN.pack(1), TOKEN.pack(3), TOKEN.pack(4)
+INT32, INT64, UINT32, UINT64 = Struct("<Hi"), Struct("<Hq"), Struct("<HI"), Struct("<HQ")
+FIXED_POINT = Struct("<Hi")
+STRING = Struct("<HH")
+INT32_VALUE, UINT32_VALUE = Struct("<i"), Struct("<I")
+INT64_VALUE, UINT64_VALUE = Struct("<q"), Struct("<Q")
+INT_REGEX = re.compile(r"-?\d+")
+FIXED_POINT_REGEX = re.compile(r"-?\d+\.\d{3}")
+DATE_REGEX = re.compile(r"(-?\d+)\.(\d+)\.(\d+)\.(\d+)")
+DECIMAL_REGEX = re.compile(r"(-?\d+)(?:\.(\d{1,3}))?")
+
+# The encoding of each integer value type
+INTEGER_TYPES = {12: INT32, 20: UINT32, 359: INT64, 668: UINT64}
+
+# What each value type can hold, for errors when a value does not fit
+VALUE_KINDS = {
+    12: "a 32-bit integer",
+    13: "a number with at most 3 decimals",
+    14: "yes or no",
+    20: "an unsigned 32-bit integer",
+    23: "an unquoted string",
+    359: "a 64-bit integer",
+    668: "an unsigned 64-bit integer",
+}
+
+
+def parse_binary_hoi4(f, progress=None, stats=None, buffer_count=READ_AHEAD_BUFFERS,
+                      buffer_size=READ_AHEAD_BUFFER_SIZE):
     """Takes an open file handler of a binary HOI4 (with the first 7 bytes
     already read) and returns a plain text representation of the contents in
-    HOI4 format."""
+    HOI4 format. If given, progress is called every so often with the number
+    of bytes read so far.
+
+    The file is read ahead on a separate thread, in buffer_count blocks of
+    buffer_size bytes (see ReadAheadReader), and the tokens are decoded
+    straight from the blocks. If a dict is given as stats, the seconds spent
+    waiting for the file ("io_wait") and decoding ("decode") are added to
+    it."""
     sections = []
-    while True:
-        text = get_token(f)
-        if text is None: break
-        sections.append(text)
+    start_time = time.perf_counter()
+    with ReadAheadReader(f, buffer_count, buffer_size) as reader:
+        data, position = b"", 0
+        for block in reader:
+            # A token can be split between two blocks
+            data = data[position:] + block
+            position = decode_tokens(data, 0, sections)
+            if progress is not None:
+                progress(reader.bytes_read)
+    if stats is not None:
+        decode_time = time.perf_counter() - start_time - reader.wait_time
+        stats["io_wait"] = stats.get("io_wait", 0.0) + reader.wait_time
+        stats["decode"] = stats.get("decode", 0.0) + decode_time
     raw_filestring = " ".join(sections)
     return decorate(raw_filestring)
 
 
+def decode_tokens(data, position, sections):
+    """Decodes the tokens in a block of a binary file from an offset, in the
+    same way as get_token, and appends their text to sections. Stops at the
+    first token that does not fit in the block, and returns its offset."""
+    end = len(data)
+    append = sections.append
+    names = NAMES
+    while position + 2 <= end:
+        number = data[position] | data[position + 1] << 8
+        start = token_end = position + 2
+        text = names.get(number)
+        if text is not None:  # A name, the most common token by far
+            pass
+        elif number == 12 or number == 13 or number == 20:
+            token_end = start + 4
+            if token_end > end: break
+            if number == 12:
+                text = str(INT32_VALUE.unpack_from(data, start)[0])
+            elif number == 13:
+                text = f"{INT32_VALUE.unpack_from(data, start)[0] / 1000:.3f}"
+            else:
+                text = str(UINT32_VALUE.unpack_from(data, start)[0])
+        elif number == 15 or number == 23:
+            if start + 2 > end: break
+            token_end = start + 2 + (data[start] | data[start + 1] << 8)
+            if token_end > end: break
+            text = data[start + 2:token_end].decode("utf-8")
+            if number == 15:
+                if '"' in text or "\\" in text:
+                    text = text.replace("\\", "\\\\").replace('"', '\\"')
+                text = f'"{text}"'
+        elif number == 14:
+            if start + 1 > end: break
+            if data[start] in (0, 1):
+                text = "yes" if data[start] else "no"
+                token_end = start + 1
+            else:
+                if start + 3 > end: break
+                token_end = start + 3 + (data[start + 1] | data[start + 2] << 8)
+                if token_end > end: break
+                text = data[start + 3:token_end].decode("utf-8")
+        elif number == 359 or number == 668:
+            token_end = start + 8
+            if token_end > end: break
+            value_format = INT64_VALUE if number == 359 else UINT64_VALUE
+            text = str(value_format.unpack_from(data, start)[0])
+        else:
+            text = f"UNKNOWN_TOKEN_{number}"
+        append(text)
+        position = token_end
+    return position
+
+
 def get_token(f):
     """Gets a single token as a string from a binary file. It will read the
     first two bytes to determine what the current token type is, and then any
@@ -56,11 +177,11 @@ def decorate(filestring):
     """Takes the algorithmically generated plain text HOI4 filestring and
     enhances it by creating string representations of dates and removing some
     unneeded quote marks."""
-    for key in ["date", "expire", "trade", "next_weather_change"]:
+    for key in DATE_KEYS:
         substitutions = []
         # Updated regex to handle potential negative numbers
         for m in re.finditer(f"([^\\s]*{key}[^\\s]*) = (-?\\d+)", filestring):
-            if int(m[2]) < 43808760: continue
+            if int(m[2]) < FIRST_DATE_HOURS: continue
             date = f'"{create_date(m[2])}"'
             substitutions.append([m.start() + len(m[1]) + 3, m.end(), date])
         sections = []
@@ -73,7 +194,8 @@ def decorate(filestring):
         sections.append(filestring[end:])
         filestring = "".join(sections)
     filestring = re.sub('"([a-zA-Z0-9_^]+)" =', r"\1 =", filestring)
-    filestring = re.sub(' id = "(.+?)"', r" id = \1", filestring)
+    # Only ids that read back as a single token, without the quotes
+    filestring = re.sub(r' id = "([^"\s\\{}=]+)"', r" id = \1", filestring)
     return filestring
 
 
@@ -113,4 +235,352 @@ def create_date(hours):
         return datestring
     except (ValueError, OverflowError):
         # Handle cases where the date calculation results in an invalid date
-        return f"INVALID_DATE_{hours}"
\ No newline at end of file
+        return f"INVALID_DATE_{hours}"
+
+
+def date_hours(datestring):
+    """
+    The inverse of create_date: takes a HOI4 string representation of a date
+    and returns its integer representation, or None if the string is not a
+    date that create_date gives back exactly.
+    """
+    m = DATE_REGEX.fullmatch(datestring)
+    if not m: return None
+    year, month, day, hour = map(int, m.groups())
+    base = datetime(2002, 1, 1, 12, 0, 0)
+    try:
+        # create_date counts the hours within a year from noon on January 1st
+        # 2002, so the first 11 hours of a year fall in 2003
+        temp_dt = datetime(2002, month, day, hour)
+        if temp_dt < base:
+            temp_dt = datetime(2003, month, day, hour)
+    except ValueError:
+        return None
+    extra_hours = int((temp_dt - base).total_seconds()) // 3600
+    years = year - 1936 - (temp_dt.year - 2002)
+    hours = 60759371 + years * 24 * 365 + extra_hours
+    if hours < FIRST_DATE_HOURS or create_date(hours) != datestring:
+        return None
+    return hours
+
+
+class BinaryWriter:
+    """
+    Encodes parsed saves in the binary HOI4 format read by parse_binary_hoi4,
+    writing to a binary file in large blocks. Names found in TOKENS are
+    written as their ids, and plain values as the smallest typed value that
+    decodes to the same text: yes and no as bools, integers as 32 or 64 bit
+    integers, numbers with 3 decimals as fixed point numbers, and the dates
+    of the keys in DATE_KEYS as hours. Anything else is written as a string.
+    If given, progress is called after each block with the number of bytes
+    written so far.
+    """
+
+    def __init__(self, f, progress=None):
+        self._file = f
+        self._buffer = bytearray()
+        self._progress = progress
+        self._scalars = {}  # The encoding of every plain value seen so far
+        self._date_keys = {}  # Whether each key seen so far holds dates
+        self.written = 0
+
+    def write(self, data):
+        """Writes the entries of a dict as the top level of a file, and
+        flushes the buffered bytes."""
+        self._write_dict(data)
+        self.flush()
+
+    def flush(self):
+        """Writes the buffered bytes to the file."""
+        self._file.write(self._buffer)
+        self.written += len(self._buffer)
+        self._buffer.clear()
+        if self._progress is not None:
+            self._progress(self.written)
+
+    def _write_dict(self, value):
+        buffer = self._buffer
+        items = value.items()
+        if next(iter(value.values()), None) is True:
+            # A block starting with a bare key reads back as a list, so the
+            # flags go after the other entries, as in HOI4Writer
+            items = sorted(items, key=lambda item: item[1] is True)
+        for key, child in items:
+            buffer += self._scalar(key)
+            if child is True:
+                continue  # A flag is written as a bare key
+            buffer += EQUALS
+            if isinstance(child, dict):
+                buffer += OPEN
+                self._write_dict(child)
+                buffer += CLOSE
+            elif isinstance(child, list):
+                buffer += OPEN
+                self._write_list(child)
+                buffer += CLOSE
+            elif self._is_date_key(key):
+                buffer += encode_date(child)
+            else:
+                buffer += self._scalar(child)
+        if len(buffer) >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def _write_list(self, value):
+        buffer = self._buffer
+        for child in value:
+            if isinstance(child, dict):
+                buffer += OPEN
+                self._write_dict(child)
+                buffer += CLOSE
+            elif isinstance(child, list):
+                buffer += OPEN
+                self._write_list(child)
+                buffer += CLOSE
+            else:
+                buffer += self._scalar(child)
+
+    def _is_date_key(self, key):
+        is_date_key = self._date_keys.get(key)
+        if is_date_key is None:
+            is_date_key = self._date_keys[key] = any(name in key for name in DATE_KEYS)
+        return is_date_key
+
+    def _scalar(self, value):
+        encoded = self._scalars.get(value)
+        if encoded is None:
+            encoded = self._scalars[value] = encode_scalar(str(value))
+        return encoded
+
+
+def encode_scalar(text):
+    """Returns the binary encoding of a plain value (see BinaryWriter)."""
+    if text == "yes" or text == "no":
+        return TOKEN.pack(14) + (b"\x01" if text == "yes" else b"\x00")
+    if INT_REGEX.fullmatch(text) and str(int(text)) == text:
+        number = int(text)
+        if -(1 << 31) <= number < 1 << 31:
+            return INT32.pack(12, number)
+        if 0 <= number < 1 << 32:
+            return UINT32.pack(20, number)
+        if -(1 << 63) <= number < 1 << 63:
+            return INT64.pack(359, number)
+        if 0 <= number < 1 << 64:
+            return UINT64.pack(668, number)
+    elif FIXED_POINT_REGEX.fullmatch(text):
+        number = int(text.replace(".", ""))
+        if -(1 << 31) <= number < 1 << 31 and f"{number / 1000:.3f}" == text:
+            return FIXED_POINT.pack(13, number)
+    if NEEDS_QUOTES_REGEX.search(text):
+        return encode_string(15, text)
+    number = TOKEN_IDS.get(text)
+    if number is not None:
+        return TOKEN.pack(number)
+    return encode_string(23, text)
+
+
+def encode_date(text):
+    """Returns the binary encoding of the value of a key in DATE_KEYS."""
+    hours = date_hours(text)
+    if hours is not None:
+        return INT32.pack(12, hours)
+    if INT_REGEX.fullmatch(text) and int(text) >= FIRST_DATE_HOURS:
+        # Quoted, so that decorate does not turn it into a date
+        return encode_string(15, text)
+    return encode_scalar(text)
+
+
+def encode_string(value_type, text):
+    """Encodes a quoted (15) or unquoted (23) string."""
+    data = text.encode("utf-8")
+    if len(data) > 0xFFFF:
+        raise ValueError(f"String too long for a binary save: {text[:50]}...")
+    return STRING.pack(value_type, len(data)) + data
+
+
+def encode_like(old, text):
+    """
+    Returns the binary encoding of a plain value as the same type as old, the
+    encoded value it replaces, such as a fixed point number for "1" where the
+    save held "0.300". Names from TOKENS are replaced by other names or by
+    unquoted strings. Raises ValueError if the value does not fit the type.
+    """
+    number = TOKEN.unpack_from(old)[0]
+    if number in INTEGER_TYPES:
+        if INT_REGEX.fullmatch(text):
+            try:
+                return INTEGER_TYPES[number].pack(number, int(text))
+            except StructError:
+                pass
+    elif number == 13:
+        m = DECIMAL_REGEX.fullmatch(text)
+        if m:
+            try:
+                return FIXED_POINT.pack(13, int(m[1] + (m[2] or "").ljust(3, "0")))
+            except StructError:
+                pass
+    elif number == 14 and old[2] in (0, 1):
+        if text == "yes" or text == "no":
+            return encode_scalar(text)
+    elif number == 15:
+        return encode_string(15, text)
+    elif not NEEDS_QUOTES_REGEX.search(text):
+        if number == 14:  # An unquoted string after a byte of its own
+            return old[:3] + encode_string(14, text)[2:]
+        if number == 23:
+            return encode_string(23, text)
+        name = TOKEN_IDS.get(text)
+        return encode_string(23, text) if name is None else TOKEN.pack(name)
+    raise ValueError(f"The value there is {VALUE_KINDS.get(number, VALUE_KINDS[23])}, not {text!r}")
+
+
+def write_binary_hoi4(data, f, progress=None):
+    """Writes a parsed save to the binary file f in the binary HOI4 format,
+    starting with the HOI4bin header (see BinaryWriter). Returns the number
+    of bytes written."""
+    f.write(b"HOI4bin")
+    writer = BinaryWriter(f, progress)
+    writer.write(data)
+    return writer.written + 7
+
+
+def patch_binary_hoi4(path, keys, value):
+    """
+    Sets a plain value in a binary HOI4 save file, without decoding the rest
+    of the file. keys is the list of keys leading to the value, with list
+    elements given as "[i]". Where a key appears more than once in a block,
+    the last one is used, as it is the one the parsed save holds.
+
+    Only the blocks on the way to the value are scanned to find its bytes,
+    skipping over the blocks of other keys. If the new encoding is the same
+    size, such as an integer replacing an integer, only those bytes are
+    overwritten; otherwise the rest of the file is moved to make room.
+    Returns the old value.
+
+    The new value keeps the type of the old one (see encode_like), and
+    ValueError is raised if it does not fit, rather than changing the type
+    of something the game reads.
+    """
+    with open(path, "r+b") as f:
+        with mmap.mmap(f.fileno(), 0) as data:
+            if data[:7] != b"HOI4bin":
+                raise ValueError(f"{path} is not a binary HOI4 save")
+            start, end = find_value(data, keys)
+            old_value = get_token(io.BytesIO(data[start:end]))
+            if any(name in str(keys[-1]) for name in DATE_KEYS):
+                hours = date_hours(value)
+                if INT_REGEX.fullmatch(old_value):
+                    if hours is not None:
+                        value = str(hours)
+                    if int(old_value) >= FIRST_DATE_HOURS:
+                        old_value = create_date(old_value)
+            encoded = encode_like(data[start:end], value)
+            old_value = old_value.strip('"')
+            if len(encoded) == end - start:
+                data[start:end] = encoded
+                return old_value
+        replace_bytes(f, start, end, encoded)
+    return old_value
+
+
+def find_value(data, keys):
+    """Returns the (start, end) offsets of the token holding the plain value
+    at a path of keys (see patch_binary_hoi4) in the bytes of a binary save."""
+    position = 7
+    for depth, key in enumerate(keys):
+        found = None
+        index = 0
+        while position < len(data):
+            number, token_end = read_token(data, position)
+            if number == 4:  # The end of the block
+                break
+            next_number = None
+            if token_end < len(data):
+                next_number, next_end = read_token(data, token_end)
+            if next_number == 1:  # A key and its value
+                value_start = next_end
+                text = get_token(io.BytesIO(data[position:token_end])).strip('"')
+                if text == key:
+                    found = value_start  # Later ones replace it
+                value_number, position = read_token(data, value_start)
+            else:  # A list element, or a flag
+                if key == f"[{index}]":
+                    found = position
+                    break
+                index += 1
+                value_number, position = number, token_end
+            if value_number == 3:
+                position = skip_block(data, position)
+        if found is None:
+            raise KeyError(".".join(keys[:depth + 1]))
+
+        value_number, position = read_token(data, found)
+        if depth == len(keys) - 1:
+            if value_number == 3:
+                raise ValueError(f"{'.'.join(keys)} is a block, not a plain value")
+            return found, position
+        if value_number != 3:
+            raise KeyError(".".join(keys[:depth + 2]))
+
+
+# The size of each typed value, after its type's 2 bytes
+VALUE_SIZES = {12: 4, 13: 4, 20: 4, 359: 8, 668: 8}
+
+
+def read_token(data, position):
+    """Returns the token id at an offset in the bytes of a binary save, and
+    the offset where the token and any value that belongs to it end."""
+    number = data[position] | data[position + 1] << 8
+    position += 2
+    size = VALUE_SIZES.get(number)
+    if size is not None:
+        return number, position + size
+    if number == 15 or number == 23:
+        return number, position + 2 + (data[position] | data[position + 1] << 8)
+    if number == 14:
+        if data[position] in (0, 1):
+            return number, position + 1
+        return number, position + 3 + (data[position + 1] | data[position + 2] << 8)
+    return number, position
+
+
+def skip_block(data, position):
+    """Returns the offset just after the end of the block whose contents
+    start at an offset."""
+    depth = 1
+    while depth:
+        number, position = read_token(data, position)
+        if number == 3:
+            depth += 1
+        elif number == 4:
+            depth -= 1
+    return position
+
+
+def replace_bytes(f, start, end, replacement, chunk_size=WRITE_BUFFER_SIZE):
+    """Replaces the bytes from start to end of a file opened for reading and
+    writing with bytes of another length, moving the rest of the file in
+    chunks."""
+    size = f.seek(0, 2)
+    shift = len(replacement) - (end - start)
+    if shift > 0:
+        # Move the rest of the file up from the end, so nothing is overwritten
+        # before it is moved
+        position = size
+        while position > end:
+            chunk_start = max(end, position - chunk_size)
+            f.seek(chunk_start)
+            chunk = f.read(position - chunk_start)
+            f.seek(chunk_start + shift)
+            f.write(chunk)
+            position = chunk_start
+    else:
+        position = end
+        while position < size:
+            f.seek(position)
+            chunk = f.read(chunk_size)
+            f.seek(position + shift)
+            f.write(chunk)
+            position += len(chunk)
+        f.truncate(size + shift)
+    f.seek(start)
+    f.write(replacement)
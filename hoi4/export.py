@@ -0,0 +1,388 @@
+"""Functions for writing parsed saves out to files."""
+
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+import queue
+import threading
+from json.encoder import encode_basestring_ascii as encode_string
+
+from hoi4.parse import load_as_text
+from hoi4.plain import NEEDS_QUOTES_REGEX
+from hoi4.search import iter_children
+
+# Chunks of text collected before they are written to the file
+BUFFERED_CHUNKS = 1 << 14
+
+FORMATS = ("pretty", "compact", "ndjson")
+
+# The compression used for each extension of an export file
+COMPRESSED_EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz"}
+
+COMPRESSION_BLOCK_SIZE = 1 << 20  # Bytes handed to the compression thread at a time
+COMPRESSION_QUEUE_SIZE = 8  # Blocks waiting to be compressed before writes block
+
+
+class JSONWriter:
+    """
+    Writes parsed saves to a text file as JSON while walking them, without
+    building the whole document in memory first. The text is collected in
+    chunks and written in large blocks.
+
+    With an indent, the output is the same as json.dump(value, f,
+    indent=indent); without one, it has no whitespace at all. If given,
+    progress is called after each block with the number of characters
+    written so far.
+    """
+
+    def __init__(self, f, indent=None, progress=None):
+        self._file = f
+        self._indent = indent
+        self._colon = ": " if indent is not None else ":"
+        self._newlines = []  # The line break and indentation of each level
+        self._chunks = []
+        self._progress = progress
+        self.written = 0
+
+    def write(self, value):
+        """Writes a value and flushes the buffered text."""
+        self._write_value(value, 0)
+        self.flush()
+
+    def write_lines(self, data):
+        """Writes each entry of a dict as a one-entry object on its own line,
+        making a file of newline-delimited JSON."""
+        for key, value in data.items():
+            self._chunks.append("{" + encode_key(key) + self._colon)
+            self._write_value(value, 1)
+            self._chunks.append("}\n")
+        self.flush()
+
+    def flush(self):
+        """Writes the buffered text to the file."""
+        text = "".join(self._chunks)
+        self._chunks.clear()
+        self._file.write(text)
+        self.written += len(text)
+        if self._progress is not None:
+            self._progress(self.written)
+
+    def _newline(self, level):
+        """Returns the text that starts a line at an indentation level."""
+        while len(self._newlines) <= level:
+            if self._indent is None:
+                self._newlines.append("")
+            else:
+                self._newlines.append("\n" + " " * (self._indent * len(self._newlines)))
+        return self._newlines[level]
+
+    def _write_value(self, value, level):
+        chunks = self._chunks
+        if isinstance(value, str):
+            chunks.append(encode_string(value))
+            return
+        if not isinstance(value, (dict, list)):
+            chunks.append(json.dumps(value))
+            return
+        if not value:
+            chunks.append("{}" if isinstance(value, dict) else "[]")
+            return
+
+        newline = self._newline(level + 1)
+        separator = newline
+        if isinstance(value, dict):
+            chunks.append("{")
+            for key, child in value.items():
+                chunks.append(separator + encode_key(key) + self._colon)
+                if isinstance(child, str):
+                    chunks.append(encode_string(child))
+                else:
+                    self._write_value(child, level + 1)
+                separator = "," + newline
+            chunks.append(self._newline(level) + "}")
+        else:
+            chunks.append("[")
+            for child in value:
+                chunks.append(separator)
+                if isinstance(child, str):
+                    chunks.append(encode_string(child))
+                else:
+                    self._write_value(child, level + 1)
+                separator = "," + newline
+            chunks.append(self._newline(level) + "]")
+
+        if len(chunks) >= BUFFERED_CHUNKS:
+            self.flush()
+
+
+def encode_key(key):
+    """Encodes a dict key the way the json module does."""
+    return encode_string(key if isinstance(key, str) else json.dumps(key))
+
+
+def write_json(data, f, format="pretty", progress=None):
+    """
+    Writes a parsed save to the text file f in one of FORMATS: "pretty" is
+    indented by 4 spaces, "compact" has no whitespace, and "ndjson" puts each
+    top-level entry on a line of its own. Returns the number of characters
+    written.
+    """
+    writer = JSONWriter(f, 4 if format == "pretty" else None, progress)
+    if format == "ndjson":
+        writer.write_lines(data)
+    else:
+        writer.write(data)
+    return writer.written
+
+
+class HOI4Writer:
+    """
+    Writes parsed saves to a text file in the plain text HOI4 format, while
+    walking them, with the same buffering as JSONWriter. Dicts are written one
+    entry per line and indented with tabs, lists of plain values on a single
+    line, and flags (keys parsed with a value of True) as bare keys after the
+    other entries. Strings are quoted when they would not read back as a
+    single token. What is written reads back the same with filestring_to_dict,
+    except that a dict of nothing but flags reads back as a list of their
+    keys, and an empty list as an empty dict, as they are written the same.
+    """
+
+    def __init__(self, f, progress=None):
+        self._file = f
+        self._indents = [""]
+        self._chunks = []
+        self._progress = progress
+        self.written = 0
+
+    def write(self, value):
+        """Writes the entries of a dict, or the elements of a list, as the
+        top level of a file, and flushes the buffered text."""
+        if isinstance(value, dict):
+            self._write_dict(value, 0)
+        else:
+            self._write_list(value, 0)
+        self.flush()
+
+    def flush(self):
+        """Writes the buffered text to the file."""
+        text = "".join(self._chunks)
+        self._chunks.clear()
+        self._file.write(text)
+        self.written += len(text)
+        if self._progress is not None:
+            self._progress(self.written)
+
+    def _indent(self, level):
+        while len(self._indents) <= level:
+            self._indents.append("\t" * len(self._indents))
+        return self._indents[level]
+
+    def _write_dict(self, value, level):
+        chunks = self._chunks
+        indent = self._indent(level)
+        items = value.items()
+        if next(iter(value.values()), None) is True:
+            # A block starting with a bare key reads back as a list, so the
+            # flags go after the other entries
+            items = sorted(items, key=lambda item: item[1] is True)
+        for key, child in items:
+            if child is True:
+                chunks.append(f"{indent}{quote(key)}\n")
+            elif isinstance(child, (dict, list)):
+                chunks.append(f"{indent}{quote(key)} = ")
+                self._write_block(child, level)
+                chunks.append("\n")
+            else:
+                chunks.append(f"{indent}{quote(key)} = {quote(child)}\n")
+
+    def _write_list(self, value, level):
+        chunks = self._chunks
+        indent = self._indent(level)
+        if not any(isinstance(child, (dict, list)) for child in value):
+            chunks.append(indent + " ".join(quote(child) for child in value) + "\n")
+            return
+        for child in value:
+            chunks.append(indent)
+            if isinstance(child, (dict, list)):
+                self._write_block(child, level)
+            else:
+                chunks.append(quote(child))
+            chunks.append("\n")
+
+    def _write_block(self, value, level):
+        """Writes a dict or list in braces, starting on the current line."""
+        chunks = self._chunks
+        if not value:
+            chunks.append("{ }")
+        elif isinstance(value, list) and not any(isinstance(child, (dict, list)) for child in value):
+            chunks.append("{ " + " ".join(quote(child) for child in value) + " }")
+        else:
+            chunks.append("{\n")
+            if isinstance(value, dict):
+                self._write_dict(value, level + 1)
+            else:
+                self._write_list(value, level + 1)
+            chunks.append(self._indent(level) + "}")
+            if len(chunks) >= BUFFERED_CHUNKS:
+                self.flush()
+
+
+def quote(value):
+    """Returns a plain value as a HOI4 text token, quoted if need be, with
+    backslashes and quote marks escaped inside the quotes."""
+    value = str(value)
+    if NEEDS_QUOTES_REGEX.search(value):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return value
+
+
+def write_hoi4(data, f, progress=None):
+    """Writes a dict (or list) to the text file f in the plain text HOI4
+    format (see HOI4Writer). Returns the number of characters written."""
+    writer = HOI4Writer(f, progress)
+    writer.write(data)
+    return writer.written
+
+
+def write_save_text(path, f, progress=None, chunk_size=COMPRESSION_BLOCK_SIZE):
+    """
+    Writes the whole of a save file to the text file f in the plain text HOI4
+    format, decoded again from the file (see load_as_text) rather than
+    written from its parsed dict, which keeps only the last of any repeated
+    key. Returns the number of characters written. If given, progress is
+    called every so often with the characters written, and with 0 while the
+    file is being decoded.
+    """
+    report = None if progress is None else lambda done, total: progress(0)
+    text = load_as_text(path, report)
+    for start in range(0, len(text), chunk_size):
+        f.write(text[start:start + chunk_size])
+        if progress is not None:
+            progress(min(start + chunk_size, len(text)))
+    return len(text)
+
+
+def iter_leaves(value, path=""):
+    """Yields a (dotted path, value) pair for every plain value anywhere below
+    a dict or list, in order. List elements are keyed "[i]"."""
+    for key, child in iter_children(value):
+        child_path = f"{path}.{key}" if path else key
+        if isinstance(child, (dict, list)):
+            yield from iter_leaves(child, child_path)
+        else:
+            yield child_path, child
+
+
+def write_csv(value, f, progress=None):
+    """
+    Writes a dict or list to the text file f as CSV, and returns the number
+    of characters written. When all of its entries are dicts or lists, such
+    as the divisions of a country, each entry becomes a row, with its key and
+    a column for every dotted path found below any of the entries. Otherwise
+    there is a row for every plain value below it, with its dotted path. If
+    given, progress is called every so often with the characters written.
+    """
+    writer = csv.writer(f, lineterminator="\n")  # The file translates newlines
+    entries = list(iter_children(value))
+    if entries and all(isinstance(child, (dict, list)) for _, child in entries):
+        # The columns have to be known before the first row is written
+        columns = {}
+        for _, child in entries:
+            for path, _ in iter_leaves(child):
+                columns.setdefault(path)
+        rows = (
+            [key, *map(dict(iter_leaves(child)).get, columns)]
+            for key, child in entries
+        )
+        header = ["key", *columns]
+    else:
+        rows = ([path, leaf] for path, leaf in iter_leaves(value))
+        header = ["path", "value"]
+
+    written = writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        written += writer.writerow(row)
+        if progress is not None and count % BUFFERED_CHUNKS == 0:
+            progress(written)
+    if progress is not None:
+        progress(written)
+    return written
+
+
+def export_compression(path):
+    """Returns the compression to use for an export file, by its extension,
+    or None for an uncompressed file."""
+    return COMPRESSED_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def open_export(path, compression=None, binary=False):
+    """
+    Opens an export file for writing, as text unless binary is True. With a
+    compression ("gzip", "bz2" or "xz"), what is written is compressed on a
+    separate thread (see CompressingWriter), so that compression overlaps
+    with writing the export.
+    """
+    if compression is None:
+        return open(path, "wb") if binary else open(path, "w", encoding="utf-8")
+    f = io.BufferedWriter(CompressingWriter(open(path, "wb"), compression),
+                          COMPRESSION_BLOCK_SIZE)
+    return f if binary else io.TextIOWrapper(f, encoding="utf-8")
+
+
+class CompressingWriter(io.RawIOBase):
+    """
+    A binary file that compresses the blocks written to it on a thread of
+    its own and writes them to another file. The queue between the two is
+    bounded, so a fast writer waits for compression rather than filling up
+    memory. An error on the compression thread is raised by the next write,
+    or by close.
+    """
+
+    def __init__(self, f, compression):
+        super().__init__()
+        self._file = f
+        if compression == "gzip":
+            self._compressed = gzip.GzipFile(fileobj=f, mode="wb")
+        elif compression == "bz2":
+            self._compressed = bz2.BZ2File(f, "wb")
+        else:
+            self._compressed = lzma.LZMAFile(f, "wb")
+        self._queue = queue.Queue(COMPRESSION_QUEUE_SIZE)
+        self._error = None
+        self._thread = threading.Thread(target=self._compress, daemon=True)
+        self._thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def _compress(self):
+        """Compresses blocks from the queue until the None that ends it."""
+        try:
+            while (data := self._queue.get()) is not None:
+                self._compressed.write(data)
+            self._compressed.close()
+        except Exception as e:
+            self._error = e
+            # Keep taking blocks, so that the writer is never stuck waiting
+            while self._queue.get() is not None:
+                pass
+
+    def close(self):
+        if self.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        super().close()
+        if self._error is not None:
+            raise self._error
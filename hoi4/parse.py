@@ -1,24 +1,142 @@
 """Tools for parsing loading data from files."""
 
-from hoi4.binary import parse_binary_hoi4
-from hoi4.plain import filestring_to_dict
+import os
+import bz2
+import gzip
+import lzma
+import zipfile
+from hoi4.binary import parse_binary_hoi4, decode_tokens, decorate, read_token
+from hoi4.plain import filestring_to_dict, TOKEN_REGEX
 
+READ_CHUNK_SIZE = 1 << 22
+PROBE_SIZE = 1 << 14  # Bytes read from the start of a save by probe
 
-def load_as_text(path):
+# The magic bytes that start each kind of compressed file
+COMPRESSED_FORMATS = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"PK\x03\x04": "zip",
+}
+
+
+def open_save(raw):
+    """
+    Takes a save file opened in binary mode and returns a file to read the
+    save from. If the file is gzip, bz2, xz or zip compressed, which is told
+    by its first bytes, the returned file decompresses it as it is read;
+    otherwise it is the file itself. A zip file is expected to hold the save
+    as its first file.
+    """
+    start = raw.read(6)
+    raw.seek(0)
+    for magic, compression in COMPRESSED_FORMATS.items():
+        if start.startswith(magic):
+            break
+    else:
+        return raw
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw)
+    if compression == "bz2":
+        return bz2.BZ2File(raw)
+    if compression == "xz":
+        return lzma.LZMAFile(raw)
+    archive = zipfile.ZipFile(raw)
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    if not names:
+        raise ValueError("The zip file holds no save file")
+    return archive.open(names[0])
+
+
+def load_as_text(path, progress=None, stats=None):
     """Gets a plain-text filestring from a HOI4 save file, regardless of whether
-    the file is a binary save file or a plain text save file. The first 7 bytes
-    are omitted."""
+    the file is a binary save file or a plain text save file, and whether or
+    not it is compressed (see open_save). The first 7 bytes are omitted. If
+    given, progress is called every so often with the number of bytes of the
+    file read so far and the size of the file. Binary saves are read ahead on
+    a separate thread, and if a dict is given as stats, the time spent
+    waiting for the file and decoding it is added to it (see
+    parse_binary_hoi4)."""
 
-    with open(path, "rb") as f:
+    total = os.path.getsize(path)
+    with open(path, "rb") as raw:
+        # Progress is measured in the file itself, even if it is compressed
+        report = None if progress is None else lambda done: progress(raw.tell(), total)
+        f = open_save(raw)
         if f.read(7) == b"HOI4bin":
-            return parse_binary_hoi4(f)
-        else:
+            return parse_binary_hoi4(f, report, stats)
+        elif report is None:
             return f.read().decode("utf-8")
+        chunks = []
+        while chunk := f.read(READ_CHUNK_SIZE):
+            chunks.append(chunk)
+            report(f.tell())
+        return b"".join(chunks).decode("utf-8")
 
 
-def load_as_dict(path):
+def load_as_dict(path, strings=None, progress=None, stats=None):
     """Gets a Python dictionary representation of a HOI4 save file, regardless
-    of whether the file is a binary save file or a plain text save file."""
+    of whether the file is a binary save file or a plain text save file. If a
+    dict is given as strings, the distinct strings are collected in it. If
+    given, progress is called as for load_as_text and then filestring_to_dict,
+    so it counts up to its total twice. stats is as for load_as_text."""
+
+    filestring = load_as_text(path, progress, stats)
+    return filestring_to_dict(filestring, strings, progress)
+
+
+def probe(path, size=PROBE_SIZE):
+    """
+    Gets the metadata of a HOI4 save file from its first size bytes only,
+    without parsing the rest, which is much faster than load_as_dict for a
+    folder of saves. Returns a dict with the "player" tag, the game "date",
+    the game "version", whether the save is "ironman", and the "save_type"
+    ("binary" or "plain"). The metadata is taken from the plain values at the
+    top level before the first block; any that are not found there are None.
+    The save may be compressed (see open_save).
+    """
+    with open(path, "rb") as raw:
+        header = open_save(raw).read(size)
+    if header.startswith(b"HOI4bin"):
+        # Only the tokens before the first block are decoded
+        end = 7
+        try:
+            while end < len(header):
+                number, token_end = read_token(header, end)
+                if number == 3 or token_end > len(header):
+                    break
+                end = token_end
+        except IndexError:  # The last token is cut off by size
+            pass
+        sections = []
+        decode_tokens(header[:end], 7, sections)
+        text = decorate(" ".join(sections))
+        save_type = "binary"
+    elif header.startswith(b"HOI4txt"):
+        block = header.find(b"{")
+        if block != -1:
+            header = header[:block]
+        elif len(header) == size:
+            header = header.rsplit(None, 1)[0]  # The last token may be cut off
+        text = header[7:].decode("utf-8", errors="ignore")
+        save_type = "plain"
+    else:
+        raise ValueError(f"{path} is not a HOI4 save file")
 
-    filestring = load_as_text(path)
-    return filestring_to_dict(filestring)
\ No newline at end of file
+    values = {}
+    key = equals = None
+    for match in TOKEN_REGEX.finditer(text):
+        token = match[0]
+        if token == "{":
+            break
+        if equals == "=" and key not in values:
+            values[key] = token.strip('"')
+        key, equals = equals, token
+    ironman = values.get("ironman")
+    return {
+        "player": values.get("player"),
+        "date": values.get("date"),
+        "version": values.get("version"),
+        "ironman": None if ironman is None else ironman == "yes",
+        "save_type": save_type,
+    }
\ No newline at end of file
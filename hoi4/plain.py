@@ -1,7 +1,7 @@
 """Functions for parsing plain text .hoi4 files."""
 
 import re
-from itertools import chain
+from itertools import chain, islice
 
 # A robust regex that correctly finds:
 # 1. Quoted strings (and preserves the quotes)
@@ -9,21 +9,46 @@ from itertools import chain
 # 3. Any other sequence of non-whitespace characters
 TOKEN_REGEX = re.compile(r'"(?:\\.|[^"\\])*"|[{}=]|\S+')
 
-def filestring_to_dict(filestring):
+# Strings that have to be quoted to be read back as one token
+NEEDS_QUOTES_REGEX = re.compile(r'[\s{}="]|^$')
+
+# A backslash escape in a quoted string, such as \" for a quote mark
+ESCAPE_REGEX = re.compile(r"\\(.)", re.DOTALL)
+
+PROGRESS_INTERVAL = 1 << 16  # Tokens parsed between progress reports
+
+def filestring_to_dict(filestring, strings=None, progress=None):
     """
     Takes a plain text HOI4 filestring and creates a Python dictionary
     representation of it.
+
+    If a dict is passed as strings, every distinct key and value string is
+    collected in it, and repeated strings in the result share one object. If
+    given, progress is called every so often with the number of tokens parsed
+    so far and the total number of tokens.
     """
     # The strip_down function is no longer needed as the new tokenizer is more powerful.
     tokens = TOKEN_REGEX.findall(filestring)
 
     # Create an iterator for efficient token consumption
-    token_iterator = iter(tokens)
+    if progress is None:
+        token_iterator = iter(tokens)
+    else:
+        token_iterator = report_progress(tokens, progress)
 
     # Begin parsing
-    return parse_token_stream(token_iterator)
-
-def parse_token_stream(token_iterator):
+    return parse_token_stream(token_iterator, strings)
+
+def report_progress(tokens, progress):
+    """Yields the tokens, calling progress with the number yielded so far and
+    the total after every PROGRESS_INTERVAL tokens."""
+    iterator = iter(tokens)
+    for done in range(0, len(tokens), PROGRESS_INTERVAL):
+        progress(done, len(tokens))
+        yield from islice(iterator, PROGRESS_INTERVAL)
+    progress(len(tokens), len(tokens))
+
+def parse_token_stream(token_iterator, strings=None):
     """
     Parses a stream of tokens from an iterator into a dictionary or list.
     This acts as the main recursive descent parser.
@@ -33,6 +58,8 @@ def parse_token_stream(token_iterator):
         first_token = next(token_iterator)
     except StopIteration:
         return {} # Empty block
+    if first_token == '}':
+        return {} # Empty block, which must not swallow the token after it
 
     # Look ahead one more token to determine structure
     try:
@@ -40,7 +67,7 @@ def parse_token_stream(token_iterator):
     except StopIteration:
         # Block has only one item, can be a list or a dict with a flag
         # e.g. { item } or { flag= } (though the latter is unlikely)
-        return [strip_quotes(first_token)]
+        return [strip_quotes(first_token, strings)]
 
     # We have at least two tokens, put them back to be processed by the main loop
     token_iterator = chain([first_token, second_token], token_iterator)
@@ -49,21 +76,21 @@ def parse_token_stream(token_iterator):
     is_list_mode = second_token != '='
 
     if is_list_mode:
-        return list(parse_list(token_iterator))
+        return list(parse_list(token_iterator, strings))
     else:
-        return dict(parse_dict(token_iterator))
+        return dict(parse_dict(token_iterator, strings))
 
-def parse_list(token_iterator):
+def parse_list(token_iterator, strings=None):
     """Parses tokens as a list of values."""
     for token in token_iterator:
         if token == '{':
-            yield parse_token_stream(token_iterator)
+            yield parse_token_stream(token_iterator, strings)
         elif token == '}':
             return
         else:
-            yield strip_quotes(token)
+            yield strip_quotes(token, strings)
 
-def parse_dict(token_iterator):
+def parse_dict(token_iterator, strings=None):
     """Parses tokens as key-value pairs."""
     while True:
         try:
@@ -71,31 +98,40 @@ def parse_dict(token_iterator):
             if key_token == '}':
                 return
 
-            equals_token = next(token_iterator)
-            if equals_token != '=':
+            # The end of the file closes the top level like a brace would
+            equals_token = next(token_iterator, '}')
+            while equals_token != '=':
                 # Handle boolean flags (key with no value)
-                yield (strip_quotes(key_token), True)
+                yield (strip_quotes(key_token, strings), True)
                 if equals_token == '}': # The flag was the last item
                     return
-                # The token we thought was '=' is actually the next key
+                # The token we thought was '=' is actually the next key,
+                # which can be another flag
                 key_token = equals_token
-                equals_token = next(token_iterator)
+                equals_token = next(token_iterator, '}')
 
 
             value_token = next(token_iterator)
 
-            key = strip_quotes(key_token)
+            key = strip_quotes(key_token, strings)
 
             if value_token == '{':
-                yield key, parse_token_stream(token_iterator)
+                yield key, parse_token_stream(token_iterator, strings)
             else:
-                yield key, strip_quotes(value_token)
+                yield key, strip_quotes(value_token, strings)
 
         except StopIteration:
             return
 
-def strip_quotes(token):
-    """Removes quotes from the start and end of a token if they exist."""
+def strip_quotes(token, strings=None):
+    """Removes quotes from the start and end of a token if they exist, and
+    the backslashes escaping quote marks and backslashes inside them. If a
+    dict of strings is given, the result is looked up in it so that equal
+    strings are only stored once."""
     if token.startswith('"') and token.endswith('"'):
-        return token[1:-1]
+        token = token[1:-1]
+        if "\\" in token:
+            token = ESCAPE_REGEX.sub(r"\1", token)
+    if strings is not None:
+        token = strings.setdefault(token, token)
     return token
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""A reader that reads a file ahead of its consumer, on a thread of its own."""
+
+import queue
+import threading
+import time
+
+READ_AHEAD_BUFFERS = 4  # Blocks read ahead of the consumer
+READ_AHEAD_BUFFER_SIZE = 1 << 20  # Bytes per block
+
+
+class ReadAheadReader:
+    """
+    Reads a binary file in fixed-size blocks on a background thread, keeping
+    up to buffer_count blocks ready ahead of the consumer, so that waiting on
+    slow storage (or decompressing, see open_save) overlaps with the
+    consumer's work. Iterating over the reader yields the blocks in order.
+
+    The reader counts the seconds the consumer spent waiting for a block in
+    wait_time, the seconds the thread spent reading in read_time, and the
+    bytes read in bytes_read.
+    """
+
+    def __init__(self, f, buffer_count=READ_AHEAD_BUFFERS, buffer_size=READ_AHEAD_BUFFER_SIZE):
+        self._file = f
+        self._buffer_size = buffer_size
+        self._queue = queue.Queue(max(1, buffer_count))
+        self._stopped = False
+        self.wait_time = 0.0
+        self.read_time = 0.0
+        self.bytes_read = 0
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        """Reads blocks into the queue until the end of the file, which is
+        marked by an empty block. An error is passed on in place of a block."""
+        try:
+            while not self._stopped:
+                start = time.perf_counter()
+                block = self._file.read(self._buffer_size)
+                self.read_time += time.perf_counter() - start
+                self.bytes_read += len(block)
+                self._queue.put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._queue.put(e)
+
+    def __iter__(self):
+        while True:
+            start = time.perf_counter()
+            block = self._queue.get()
+            self.wait_time += time.perf_counter() - start
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                return
+            yield block
+
+    def close(self):
+        """Stops the reading thread, if it is still running."""
+        self._stopped = True
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)  # Make room for a waiting put
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,479 @@
+"""An inverted index for searching the keys and values of a parsed save."""
+
+import re
+import operator
+from array import array
+from bisect import bisect_right
+from itertools import chain
+
+
+GRAM_SIZE = 3
+BATCH_SIZE = 4096
+REGEX_CHARACTERS = set("\\.^$*+?{}[]|()")
+NUMBER_REGEX = re.compile(r"-?\d+(?:\.\d+)?")
+
+# Structured query terms look like key:manpower, value>1000 or path:countries.*
+TERM_REGEX = re.compile(r'(?:[^\s"]|"[^"]*")+')
+FIELD_REGEX = re.compile(r"(key|value|path)(>=|<=|!=|:|>|<|=)(.*)", re.IGNORECASE)
+COMPARISONS = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+    "=": operator.eq, "!=": operator.ne,
+}
+
+
+def iter_nodes(data):
+    """Walks a parsed save in pre-order and yields a (node_id, parent_id, key,
+    value) tuple for every key and list element. Node ids count up from 0 in
+    the order the nodes are yielded, and top-level nodes have a parent id of
+    -1. List elements are given keys of the form "[i]"."""
+
+    next_id = 0
+    stack = [(-1, iter_children(data))]
+    while stack:
+        parent_id, children = stack[-1]
+        for key, value in children:
+            node_id = next_id
+            next_id += 1
+            yield node_id, parent_id, key, value
+            if isinstance(value, (dict, list)) and value:
+                stack.append((node_id, iter_children(value)))
+                break
+        else:
+            stack.pop()
+
+
+def iter_children(value):
+    """Yields the (key, value) pairs directly below a dict or list."""
+
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield str(key), child
+    elif isinstance(value, list):
+        for i, child in enumerate(value):
+            yield f"[{i}]", child
+
+
+def grams(text):
+    """Returns the set of lower-cased n-grams of a string."""
+
+    text = text.lower()
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+class SearchIndex:
+    """Maps every distinct key and value string in a save to the ids of the
+    nodes it appears on. Queries are run once per distinct string rather than
+    once per node, and an n-gram index over the strings means substring
+    queries only need to look at a handful of candidates."""
+
+    def __init__(self, data, strings=None):
+        """The optional strings are the distinct strings collected while the
+        save was parsed (see filestring_to_dict), which become the start of
+        the string table."""
+
+        self.parents = array("i")
+        self.keys = array("i")  # String id of each node's key
+        self.values = array("i")  # String id of each node's value, or -1
+        self.strings = list(strings) if strings else []
+        self.postings = [array("i") for _ in self.strings]
+        string_ids = {text: i for i, text in enumerate(self.strings)}
+
+        for node_id, parent_id, key, value in iter_nodes(data):
+            self.parents.append(parent_id)
+            texts = [key]
+            if not isinstance(value, (dict, list)):
+                texts.append(str(value))
+            for column, text in zip((self.keys, self.values), texts):
+                string_id = string_ids.get(text)
+                if string_id is None:
+                    string_id = string_ids[text] = len(self.strings)
+                    self.strings.append(text)
+                    self.postings.append(array("i"))
+                column.append(string_id)
+                postings = self.postings[string_id]
+                if not postings or postings[-1] != node_id:
+                    postings.append(node_id)
+            if len(texts) == 1:
+                self.values.append(-1)
+
+        # Node ids are in pre-order, so every subtree is a contiguous range of
+        # ids from the node itself up to (but not including) its end.
+        self.ends = array("i", range(1, len(self.parents) + 1))
+        for node_id in range(len(self.parents) - 1, -1, -1):
+            parent_id = self.parents[node_id]
+            if parent_id >= 0 and self.ends[node_id] > self.ends[parent_id]:
+                self.ends[parent_id] = self.ends[node_id]
+
+        # A typed column of the numeric value of every node, NaN if it has none
+        nan = float("nan")
+        string_numbers = [
+            float(text) if NUMBER_REGEX.fullmatch(text) else nan
+            for text in self.strings
+        ]
+        self.numbers = array("d", (
+            string_numbers[string_id] if string_id >= 0 else nan
+            for string_id in self.values
+        ))
+        self.string_numbers = string_numbers
+
+        self.folded = [text.lower() for text in self.strings]
+        self.grams = {}  # The ids of the strings containing each n-gram
+        for string_id, text in enumerate(self.folded):
+            for gram in grams(text):
+                postings = self.grams.get(gram)
+                if postings is None:
+                    postings = self.grams[gram] = array("I")
+                postings.append(string_id)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def path(self, node_id):
+        """Returns the dotted path of keys from the top of the save down to a
+        node, as used by path: queries."""
+
+        keys = []
+        while node_id >= 0:
+            keys.append(self.strings[self.keys[node_id]])
+            node_id = self.parents[node_id]
+        return ".".join(reversed(keys))
+
+    def value(self, node_id):
+        """Returns the value of a node as a string, or None if the node is a
+        dict or list."""
+
+        string_id = self.values[node_id]
+        return self.strings[string_id] if string_id >= 0 else None
+
+    def children(self, node_id):
+        """Yields the ids of the nodes directly below a node. A node id of -1
+        gives the top-level nodes."""
+
+        child_id, end = node_id + 1, self.ends[node_id] if node_id >= 0 else len(self)
+        while child_id < end:
+            yield child_id
+            child_id = self.ends[child_id]
+
+    def select(self, data, node_ids):
+        """Returns a copy of the save the index was built from, given as data,
+        holding only the given nodes, whole, and the dicts and lists leading
+        to them."""
+
+        return self._select(data, -1, node_ids, self.with_ancestors(node_ids))
+
+    def _select(self, value, node_id, node_ids, visible):
+        children = value.items() if isinstance(value, dict) else enumerate(value)
+        selected = {} if isinstance(value, dict) else []
+        for child_id, (key, child) in zip(self.children(node_id), children):
+            if child_id not in visible:
+                continue
+            if child_id not in node_ids and isinstance(child, (dict, list)):
+                child = self._select(child, child_id, node_ids, visible)
+            if isinstance(selected, dict):
+                selected[key] = child
+            else:
+                selected.append(child)
+        return selected
+
+    def search(self, query, within=None):
+        """Returns the set of ids of nodes whose key or value matches a query,
+        which is either text to look for, ignoring case, a compiled regular
+        expression or a structured Query (see compile_search). If within is
+        given, only those node ids are tested, which is how a search is
+        narrowed down when its query refines an earlier one (see refines)."""
+
+        matches = set()
+        for batch in self.iter_search(query, within):
+            matches.update(batch)
+        return matches
+
+    def iter_search(self, query, within=None, batch_size=BATCH_SIZE):
+        """Like search, but yields the matching node ids in lists as they are
+        found. A list is yielded at least every batch_size strings or nodes
+        checked, even if it is empty, so a caller can stop a long search
+        early."""
+
+        if isinstance(query, Query) or within is not None:
+            yield from self._iter_terms(query_terms(query), within, batch_size)
+            return
+        if isinstance(query, str):
+            text = query.lower()
+            candidates = self._candidates(text)
+            matches = lambda string_id: text in self.folded[string_id]
+        else:
+            candidates = range(len(self.strings))
+            matches = lambda string_id: query.search(self.strings[string_id])
+        batch = []
+        for i, string_id in enumerate(candidates, 1):
+            if matches(string_id):
+                batch.extend(self.postings[string_id])
+            if len(batch) >= batch_size or i % batch_size == 0:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _iter_terms(self, terms, within, batch_size):
+        """Runs a list of query terms. The term expected to match the fewest
+        nodes generates the candidates, which the other terms then check,
+        unless the candidates are given as within. Planning the terms scans
+        the string table, so empty batches are yielded while it runs too."""
+
+        plans = []
+        for term in terms:
+            plans.append((yield from self._plan_term(*term, batch_size)))
+        plans.sort(key=lambda plan: plan[0])
+        if not plans:
+            return
+        if within is None:
+            _, candidates, _ = plans.pop(0)
+        else:
+            candidates = within
+        checks = [accepts for _, _, accepts in plans]
+        batch = []
+        for i, node_id in enumerate(candidates, 1):
+            if all(accepts(node_id) for accepts in checks):
+                batch.append(node_id)
+            if i % batch_size == 0:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _plan_term(self, field, op, operand, batch_size):
+        """A generator that yields an empty batch every batch_size strings
+        scanned, and returns an (estimated number of matches, iterable of
+        candidate node ids, predicate) tuple for one query term."""
+
+        if field == "path":
+            return (yield from self._plan_path(operand, batch_size))
+        if field in ("text", "regex"):
+            if field == "text":
+                text = operand.lower()
+                string_ids = yield from self._scan(
+                    self._candidates(text), lambda i: text in self.folded[i], batch_size
+                )
+            else:
+                string_ids = yield from self._scan(
+                    range(len(self.strings)), lambda i: operand.search(self.strings[i]), batch_size
+                )
+            matched = set(string_ids)
+            accepts = lambda n: self.keys[n] in matched or self.values[n] in matched
+            column = None
+        elif op == ":":
+            pattern = glob_regex(operand)
+            string_ids = yield from self._scan(
+                range(len(self.strings)), lambda i: pattern.fullmatch(self.strings[i]), batch_size
+            )
+            matched = set(string_ids)
+            column = self.keys if field == "key" else self.values
+            accepts = lambda n: column[n] in matched
+        else:
+            compare = COMPARISONS[op]
+            numbers = self.string_numbers
+            string_ids = yield from self._scan(
+                range(len(numbers)),
+                lambda i: numbers[i] == numbers[i] and compare(numbers[i], operand),
+                batch_size
+            )
+            column = self.values
+            accepts = lambda n: self.numbers[n] == self.numbers[n] and compare(self.numbers[n], operand)
+        estimate = sum(len(self.postings[i]) for i in string_ids)
+        if column is None:
+            candidates = chain.from_iterable(self.postings[i] for i in string_ids)
+        else:
+            candidates = (
+                n for i in string_ids for n in self.postings[i] if column[n] == i
+            )
+        return estimate, candidates, accepts
+
+    def _plan_path(self, pattern, batch_size):
+        """Plans a path: term, like _plan_term. The pattern is a dotted list
+        of keys, each of which may contain * wildcards, and a trailing dot
+        matches everything below the nodes the rest of the pattern matches."""
+
+        segments = pattern.split(".") if pattern else []
+        below = bool(segments) and segments[-1] == ""
+        if below:
+            segments.pop()
+        level = [-1]
+        for segment in segments:
+            key = glob_regex(segment)
+            level = yield from self._scan(
+                (child_id for node_id in level for child_id in self.children(node_id)),
+                lambda child_id: key.fullmatch(self.strings[self.keys[child_id]]),
+                batch_size
+            )
+        if below or not segments:
+            ranges = [
+                (node_id + 1, self.ends[node_id] if node_id >= 0 else len(self))
+                for node_id in level
+            ]
+        else:
+            ranges = [(node_id, node_id + 1) for node_id in level]
+        starts = [start for start, _ in ranges]
+
+        def accepts(node_id):
+            i = bisect_right(starts, node_id) - 1
+            return i >= 0 and node_id < ranges[i][1]
+
+        estimate = sum(end - start for start, end in ranges)
+        candidates = chain.from_iterable(range(start, end) for start, end in ranges)
+        return estimate, candidates, accepts
+
+    @staticmethod
+    def _scan(ids, predicate, batch_size):
+        """A generator that yields an empty batch every batch_size ids tested,
+        so that a long scan can be stopped, and returns the list of the ids
+        predicate accepts."""
+
+        found = []
+        for i, item in enumerate(ids, 1):
+            if predicate(item):
+                found.append(item)
+            if i % batch_size == 0:
+                yield []
+        return found
+
+    def _candidates(self, text):
+        """Returns the ids of the strings that could contain the text, using
+        the n-gram index when the text is long enough."""
+
+        if len(text) < GRAM_SIZE:
+            return range(len(self.strings))
+        candidates = None
+        for gram in sorted(grams(text), key=lambda g: len(self.grams.get(g, ()))):
+            string_ids = self.grams.get(gram)
+            if not string_ids:
+                return ()
+            if candidates is None:
+                candidates = set(string_ids)
+            else:
+                candidates.intersection_update(string_ids)
+            if not candidates:
+                break
+        return candidates
+
+    def with_ancestors(self, node_ids):
+        """Returns the given node ids plus the ids of all of their ancestors,
+        which is the set of rows a tree view has to show for the matches to
+        be visible."""
+
+        visible = set()
+        self.add_ancestors(node_ids, visible)
+        return visible
+
+    def add_ancestors(self, node_ids, visible):
+        """Adds the given node ids and all of their ancestors to a set of
+        visible ids, and returns a list of the ids that were not already in
+        it. The set is assumed to already hold the ancestors of its ids."""
+
+        added = []
+        for node_id in node_ids:
+            while node_id >= 0 and node_id not in visible:
+                visible.add(node_id)
+                added.append(node_id)
+                node_id = self.parents[node_id]
+        return added
+
+
+def is_literal(text):
+    """Returns True if a search string contains no regular expression syntax,
+    so that searching for it as a regex is the same as a substring search."""
+
+    return not REGEX_CHARACTERS.intersection(text)
+
+
+def glob_regex(pattern):
+    """Compiles a pattern in which * matches any run of characters into a
+    case-insensitive regex. Every other character is matched literally."""
+
+    return re.compile(
+        ".*".join(re.escape(part) for part in pattern.split("*")), re.IGNORECASE
+    )
+
+
+class Query:
+    """A structured search query made of whitespace-separated terms, all of
+    which must hold for a node to match:
+
+    key:manpower      the key matches (* is a wildcard, case is ignored)
+    value:GER         the value matches, in the same way
+    value>1000000     the value is a number and compares as given, with any of
+                      > >= < <= = != as the operator
+    path:countries.*. the node is below countries.<anything> (without the
+                      trailing dot, the node is itself at that path)
+    text              the key or value contains the text
+
+    Parts of a term can be put in double quotes to include spaces."""
+
+    def __init__(self, text):
+        self.text = text
+        self.terms = []
+        for term in TERM_REGEX.findall(text):
+            term = term.replace('"', "")
+            match = FIELD_REGEX.fullmatch(term)
+            if not match:
+                self.terms.append(("text", ":", term))
+                continue
+            field, op, operand = match[1].lower(), match[2], match[3]
+            if op != ":":
+                if field != "value":
+                    raise ValueError(f"Only values can be compared: {term}")
+                try:
+                    operand = float(operand)
+                except ValueError:
+                    raise ValueError(f"Values can only be compared with numbers: {term}") from None
+            self.terms.append((field, op, operand))
+
+    @staticmethod
+    def is_structured(text):
+        """Returns True if any term of the text uses a key:, value or path:
+        field, rather than being plain search text."""
+
+        return any(FIELD_REGEX.fullmatch(term) for term in TERM_REGEX.findall(text))
+
+
+def query_terms(query):
+    """Returns the terms of any query accepted by SearchIndex.search, treating
+    plain text and regexes as queries of a single term."""
+
+    if isinstance(query, Query):
+        return query.terms
+    if isinstance(query, str):
+        return [("text", ":", query)]
+    return [("regex", ":", query)]
+
+
+def refines(query, previous):
+    """Returns True if every node matching query must also match previous, so
+    that a search for query only needs to test the previous matches. This is
+    the case when each term of the previous query is repeated in the new one,
+    or is a text term whose text the new one extends."""
+
+    if previous is None:
+        return False
+    terms = query_terms(query)
+    for old in query_terms(previous):
+        if old[0] == "regex" or not any(
+            new == old or (
+                new[0] == old[0] == "text" and old[2].lower() in new[2].lower()
+            )
+            for new in terms
+        ):
+            return False
+    return True
+
+
+def compile_search(text):
+    """Turns search bar text into a query for SearchIndex.search. Text using
+    key:, value or path: fields becomes a structured Query, text with no
+    regular expression syntax is searched for as a substring, and anything
+    else is compiled as a case-insensitive regex. Raises re.error for an
+    invalid regex and ValueError for an invalid structured query."""
+
+    if Query.is_structured(text):
+        return Query(text)
+    if is_literal(text):
+        return text
+    return re.compile(text, re.IGNORECASE)
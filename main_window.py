@@ -1,15 +1,26 @@
 import json
-from PySide6.QtCore import (QThread, Qt, QSortFilterProxyModel, QModelIndex, QRegularExpression, QSettings)
-from PySide6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+import re
+from PySide6.QtCore import (QThread, Qt, QSortFilterProxyModel, QModelIndex, QRegularExpression, QSettings,
+                            QTimer, Signal)
+from PySide6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QDialog,
                                QTreeView, QTextEdit, QLineEdit, QSplitter, QProgressDialog,
-                               QStatusBar, QFileDialog, QMessageBox, QStackedWidget, QLabel, QPushButton)
+                               QStatusBar, QFileDialog, QMessageBox, QStackedWidget, QLabel, QPushButton,
+                               QMenu)
 from PySide6.QtGui import QAction, QKeySequence, QFont
 
-from worker import Worker
+from worker import Worker, IndexWorker, SearchWorker, CompareWorker, TimelineWorker, ExportWorker
 from tree_model import TreeModel, TreeItem
 from pathlib import Path
-from hoi4.parse import load_as_dict # We need this for the comparison file
-from diff_logic import compare_dicts, DiffNode
+from diff_logic import rebuild_diff_tree, largest_changes_tree, DiffNode, DiffStatus, SubtreeHasher
+from hoi4.search import compile_search, refines
+from hoi4.export import write_json, write_hoi4, write_csv, write_save_text
+
+def export_filter(description, extension):
+    """Returns a file dialog filter for an export format, which also lists
+    the compressed versions of the extension (see open_export)."""
+    patterns = " ".join(f"*.{extension}{suffix}" for suffix in ("", ".gz", ".bz2", ".xz"))
+    return f"{description} ({patterns})"
+
 
 # (FilterProxyModel class remains the same as before)
 class FilterProxyModel(QSortFilterProxyModel):
@@ -18,8 +29,29 @@ class FilterProxyModel(QSortFilterProxyModel):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setRecursiveFilteringEnabled(True)
+        self._visible_ids = None
+
+    def set_visible_ids(self, visible_ids):
+        """
+        Filters by a set of node ids from the SearchIndex instead of matching
+        the regular expression row by row. Passing None returns to regex mode.
+        """
+        self._visible_ids = visible_ids
+        # The set already holds the ancestors of every match, so Qt does not
+        # have to search the descendants of a rejected row.
+        self.setRecursiveFilteringEnabled(visible_ids is None)
+        self.invalidateFilter()
+
+    def add_visible_ids(self, node_ids):
+        """Shows more rows while a background search streams in its matches."""
+        self._visible_ids.update(node_ids)
+        self.invalidateFilter()
 
     def filterAcceptsRow(self, source_row, source_parent):
+        # Node ids only exist for the TreeItems of a single file
+        if self._visible_ids is not None and not self.sourceModel().is_diff_mode:
+            item = self.sourceModel().index(source_row, 0, source_parent).internalPointer()
+            return item._id in self._visible_ids
         if not self.filterRegularExpression().pattern():
             return True
         index0 = self.sourceModel().index(source_row, 0, source_parent)
@@ -42,6 +74,23 @@ class FilterProxyModel(QSortFilterProxyModel):
 class MainWindow(QMainWindow):
     """The main window of the HOI4 Save File Viewer application."""
 
+    # Milliseconds to wait after the last keystroke before searching
+    SEARCH_DEBOUNCE_MS = 250
+
+    # Signal that queues a search on the search thread, with (index, query,
+    # generation, node ids to test or None)
+    search_requested = Signal(object, object, int, object)
+
+    # The file dialog filter for saves, which may be compressed
+    SAVE_FILTER = "HOI4 Save Files (*.hoi4 *.gz *.bz2 *.xz *.zip);;All Files (*)"
+
+    # The file dialog filters for JSON exports, and the format of each
+    JSON_FILTERS = {
+        export_filter("JSON Files", "json"): "pretty",
+        export_filter("Compact JSON Files", "json"): "compact",
+        export_filter("Newline-Delimited JSON Files", "ndjson"): "ndjson",
+    }
+
     def __init__(self):
         super().__init__()
         self.settings = QSettings("HOI4ViewerCommunity", "HOI4SaveViewer")
@@ -51,7 +100,8 @@ class MainWindow(QMainWindow):
         # --- Data Storage ---
         self.current_file_path = None
         self.parsed_data_dict = None
-        self.parsed_data_text = None  # New variable to store plain text
+        self.search_index = None  # Built in the background after each load
+        self.base_hasher = None  # Subtree digests of the loaded file, for diffs
 
         # --- Worker Thread Setup ---
         self.thread = QThread()
@@ -62,15 +112,84 @@ class MainWindow(QMainWindow):
         self.worker.error.connect(self.on_parsing_error)
         self.thread.started.connect(self.worker.run)
 
+        # --- Search Index Thread Setup ---
+        self.index_thread = QThread()
+        self.index_worker = IndexWorker()
+        self.index_worker.moveToThread(self.index_thread)
+        self.index_worker.index_ready.connect(self.on_index_ready)
+        self.index_worker.error.connect(self.on_index_error)
+        self.index_thread.started.connect(self.index_worker.run)
+
+        # --- Search Thread Setup ---
+        # The thread runs until the window closes, and searches are queued
+        # on it, so a new search never has to wait for a cancelled one
+        self.search_thread = QThread()
+        self.search_worker = SearchWorker()
+        self.search_worker.moveToThread(self.search_thread)
+        self.search_worker.matches_found.connect(self.on_search_matches)
+        self.search_worker.finished.connect(self.on_search_finished)
+        self.search_worker.error.connect(self.on_search_error)
+        self.search_requested.connect(self.search_worker.run)
+        self.search_thread.start()
+        self.search_generation = 0  # Incremented for every new search
+        self.search_query = None  # The query of the running search
+        self.last_search = None  # (query, matches) of the last completed search
+
+        # Searching starts once the user stops typing for a moment
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(lambda: self.filter_tree(self.search_bar.text()))
+
+        # --- Comparison Thread Setup ---
+        self.compare_thread = QThread()
+        self.compare_worker = CompareWorker()
+        self.compare_worker.moveToThread(self.compare_thread)
+        self.compare_worker.result_ready.connect(self.on_comparison_finished)
+        self.compare_worker.progress.connect(self.on_comparison_progress)
+        self.compare_worker.cancelled.connect(self.on_comparison_cancelled)
+        self.compare_worker.error.connect(self.on_comparison_error)
+        self.compare_thread.started.connect(self.compare_worker.run)
+        self.compare_progress = None  # The QProgressDialog of a running comparison
+
+        # --- Timeline Thread Setup ---
+        self.timeline_thread = QThread()
+        self.timeline_worker = TimelineWorker()
+        self.timeline_worker.moveToThread(self.timeline_thread)
+        self.timeline_worker.result_ready.connect(self.on_timeline_finished)
+        self.timeline_worker.progress.connect(self.on_timeline_progress)
+        self.timeline_worker.cancelled.connect(self.on_timeline_cancelled)
+        self.timeline_worker.error.connect(self.on_timeline_error)
+        self.timeline_thread.started.connect(self.timeline_worker.run)
+        self.timeline_progress = None  # The QProgressDialog of a running timeline
+        self.timeline_names = []  # File names of the saves in the timeline
+        self.timeline_dialog = None
+
+        # --- Export Thread Setup ---
+        self.export_thread = QThread()
+        self.export_worker = ExportWorker()
+        self.export_worker.moveToThread(self.export_thread)
+        self.export_worker.finished.connect(self.on_export_finished)
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.cancelled.connect(self.on_export_cancelled)
+        self.export_worker.error.connect(self.on_export_error)
+        self.export_thread.started.connect(self.export_worker.run)
+
         # --- UI Setup ---
         self._create_actions()
         self._create_menu_bar()
         self._create_main_widget()
         self.setStatusBar(QStatusBar(self))
+        # Shown in the status bar while an export is running
+        self.cancel_export_button = QPushButton("Cancel Export")
+        self.cancel_export_button.clicked.connect(self.export_worker.cancel)
+        self.cancel_export_button.setVisible(False)
+        self.statusBar().addPermanentWidget(self.cancel_export_button)
         self.update_status_bar("Ready. Open a .hoi4 save file to begin.")
         self.stacked_widget.setCurrentIndex(0)  # Start on the Welcome Screen
 
         self.is_diff_mode = False  # Add this flag
+        self.diff_root = None  # The root DiffNode of the current comparison
 
     def _create_actions(self):
         """Create actions for the menu bar."""
@@ -97,6 +216,19 @@ class MainWindow(QMainWindow):
         self.compare_action.triggered.connect(self.compare_file)
         self.compare_action.setEnabled(False)  # Disabled until a file is loaded
 
+        self.timeline_action = QAction("Compare &Timeline...", self)
+        self.timeline_action.triggered.connect(self.compare_timeline)
+
+        self.changes_only_action = QAction("Show Changes &Only", self)
+        self.changes_only_action.setCheckable(True)
+        self.changes_only_action.setChecked(True)
+        self.changes_only_action.toggled.connect(self.toggle_changes_only)
+
+        self.largest_changes_action = QAction("Show &Largest Changes", self)
+        self.largest_changes_action.setCheckable(True)
+        self.largest_changes_action.setEnabled(False)  # Only available for comparisons
+        self.largest_changes_action.toggled.connect(self.toggle_largest_changes)
+
     def _create_menu_bar(self):
         """Create the application's menu bar."""
         menu_bar = self.menuBar()
@@ -111,6 +243,10 @@ class MainWindow(QMainWindow):
         file_menu.addAction(self.open_action)
         file_menu.addAction(self.open_default_action)
         file_menu.addAction(self.compare_action)  # Add the compare action
+        file_menu.addAction(self.timeline_action)
+        view_menu = menu_bar.addMenu("&View")
+        view_menu.addAction(self.changes_only_action)
+        view_menu.addAction(self.largest_changes_action)
 
     def _create_main_widget(self):
         """
@@ -170,14 +306,16 @@ class MainWindow(QMainWindow):
         self.tree_view = QTreeView()
         self.tree_view.setAlternatingRowColors(True)
         self.tree_view.header().setStretchLastSection(True)
+        self.tree_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.tree_view.customContextMenuRequested.connect(self.show_tree_context_menu)
         left_layout.addWidget(self.tree_view)
 
         # Right Panel: Search and Details
         right_panel = QWidget()
         right_layout = QVBoxLayout(right_panel)
         self.search_bar = QLineEdit()
-        self.search_bar.setPlaceholderText("Search in tree...")
-        self.search_bar.textChanged.connect(self.filter_tree)
+        self.search_bar.setPlaceholderText("Search in tree... (e.g. key:manpower value>1000000 path:countries.*.)")
+        self.search_bar.textChanged.connect(self.on_search_text_changed)
         self.details_area = QTextEdit()
         self.details_area.setReadOnly(True)
         self.details_area.setFontFamily("Courier")
@@ -229,16 +367,12 @@ class MainWindow(QMainWindow):
         This method now handles both "Open..." and "Open Default...".
         """
 
-        # --- ADD RESET LOGIC AT THE TOP ---
-        if self.is_diff_mode:
-            self.is_diff_mode = False
-            self.legend_label.setVisible(False)
-            self.tree_view.header().setStretchLastSection(True)  # Reset column stretch
-        # --- END ADD ---
-
-        if self.thread.isRunning():
+        if self.thread.isRunning() or self.index_thread.isRunning():
             QMessageBox.warning(self, "Busy", "A file is already being parsed. Please wait.")
             return
+        if self.compare_thread.isRunning():
+            QMessageBox.warning(self, "Busy", "A comparison is running. Please wait or cancel it.")
+            return
 
         # --- SMART DIRECTORY LOGIC ---
         start_dir = ""
@@ -254,10 +388,20 @@ class MainWindow(QMainWindow):
         file_path, _ = QFileDialog.getOpenFileName(
             self, "Open HOI4 Save File",
             dir=start_dir,  # <-- FIX: The keyword is 'dir', not 'directory'
-            filter="HOI4 Save Files (*.hoi4)"
+            filter=self.SAVE_FILTER
         )
 
         if file_path:
+            # Leave diff mode only once a file is chosen, so that cancelling
+            # the dialog keeps the comparison on screen
+            if self.is_diff_mode:
+                self.is_diff_mode = False
+                self.diff_root = None
+                self.largest_changes_action.setChecked(False)
+                self.largest_changes_action.setEnabled(False)
+                self.legend_label.setVisible(False)
+                self.tree_view.header().setStretchLastSection(True)  # Reset column stretch
+
             self.stacked_widget.setCurrentIndex(1)  # Switch to the Data View
             # --- REMEMBER DIRECTORY LOGIC ---
             # Get the parent folder of the file they chose
@@ -267,6 +411,11 @@ class MainWindow(QMainWindow):
             # --- END OF LOGIC ---
 
             self.current_file_path = file_path
+            self.cancel_search()
+            self.search_index = None
+            self.last_search = None
+            self.base_hasher = None
+            self.proxy_model.set_visible_ids(None)
             self.tree_model.setup_single_file_data({})
             self.details_area.clear()
             self.save_json_action.setEnabled(False)
@@ -280,49 +429,125 @@ class MainWindow(QMainWindow):
         if self.parsed_data_dict is None:
             return
 
-        file_path, _ = QFileDialog.getSaveFileName(
-            self, "Save as JSON", "", "JSON Files (*.json)")
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self, "Save as JSON", "", ";;".join(self.JSON_FILTERS))
 
         if file_path:
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.parsed_data_dict, f, indent=4)
-                self.update_status_bar(f"Successfully saved to {file_path}")
-            except Exception as e:
-                QMessageBox.critical(self, "Save Error", f"Could not save JSON file:\n{e}")
+            data = self.parsed_data_dict
+            format = self.JSON_FILTERS.get(selected_filter, "pretty")
+            self.start_export(file_path, lambda f, progress: write_json(data, f, format, progress))
 
     def save_as_text(self):
-        """Saves the plain text representation of the save file instantly."""
-        # This function no longer needs to call any slow parsing functions.
-        if self.parsed_data_text is None:
+        """Saves the whole save file in the plain text HOI4 format. The file is
+        decoded again on the export thread, since the parsed dictionary does
+        not hold repeated keys (see write_save_text)."""
+        if self.parsed_data_dict is None:
             return
 
         file_path, _ = QFileDialog.getSaveFileName(
-            self, "Save as Plain Text", "", "Text Files (*.txt)")
+            self, "Save as Plain Text", "", export_filter("Text Files", "txt"))
 
         if file_path:
-            try:
-                # Simply write the stored plain text to the file.
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(self.parsed_data_text)
-                self.update_status_bar(f"Successfully saved to {file_path}")
-            except Exception as e:
-                QMessageBox.critical(self, "Save Error", f"Could not save plain text file:\n{e}")
+            save_path = self.current_file_path
+            self.start_export(file_path, lambda f, progress: write_save_text(save_path, f, progress))
+
+    def show_tree_context_menu(self, position):
+        """Offers to export the subtree of the node under the cursor."""
+        proxy_index = self.tree_view.indexAt(position)
+        if not proxy_index.isValid():
+            return
+        item = self.proxy_model.mapToSource(proxy_index).internalPointer()
+        menu = QMenu(self)
+        menu.addAction("Export as JSON...", lambda: self.export_subtree(item, "json"))
+        menu.addAction("Export as CSV...", lambda: self.export_subtree(item, "csv"))
+        menu.addAction("Export as Plain Text...", lambda: self.export_subtree(item, "text"))
+        menu.exec(self.tree_view.viewport().mapToGlobal(position))
+
+    def export_subtree(self, item, format):
+        """Exports the value of one node of the tree, written straight from
+        the node without going through the rest of the save."""
+        if isinstance(item, DiffNode):
+            # The new value, or the old one for a removed entry
+            key = item.key
+            value = item.value_a if item.status == DiffStatus.REMOVED else item.value_b
+        else:
+            key, value = item._key, item._value
+
+        name = re.sub(r"[^\w.-]", "_", key)
+        if format == "json":
+            file_path, _ = QFileDialog.getSaveFileName(
+                self, f"Export '{key}' as JSON", f"{name}.json", export_filter("JSON Files", "json"))
+            write = lambda f, progress: write_json(value, f, "pretty", progress)
+        elif format == "csv":
+            file_path, _ = QFileDialog.getSaveFileName(
+                self, f"Export '{key}' as CSV", f"{name}.csv", export_filter("CSV Files", "csv"))
+            if not isinstance(value, (dict, list)):
+                value = {key: value}
+            write = lambda f, progress: write_csv(value, f, progress)
+        else:
+            file_path, _ = QFileDialog.getSaveFileName(
+                self, f"Export '{key}' as Plain Text", f"{name}.txt", export_filter("Text Files", "txt"))
+            # List elements have no key of their own to write
+            data = [value] if key.startswith("[") else {key: value}
+            write = lambda f, progress: write_hoi4(data, f, progress)
+
+        if file_path:
+            self.start_export(file_path, write)
+
+    def start_export(self, file_path, write):
+        """Writes an export file on the export thread. write is called there
+        with the open file and a progress callback (see ExportWorker)."""
+        if self.export_thread.isRunning():
+            QMessageBox.information(self, "Export Running", "Please wait for the current export to finish.")
+            return
+        self.export_worker.set_task(file_path, write)
+        self.cancel_export_button.setVisible(True)
+        self.update_status_bar(f"Saving {file_path}...")
+        self.export_thread.start()
+
+    def on_export_progress(self, written):
+        # The writers count characters, which is not the size of the file
+        # once it is encoded or compressed
+        self.update_status_bar(f"Saving... {written / 1e6:.1f} million characters written")
+
+    def _end_export(self):
+        """Stops the export thread and hides its cancel button."""
+        self.export_thread.quit()
+        self.export_thread.wait()
+        self.cancel_export_button.setVisible(False)
+
+    def on_export_finished(self, file_path):
+        self._end_export()
+        self.update_status_bar(f"Successfully saved to {file_path}")
+
+    def on_export_cancelled(self):
+        self._end_export()
+        self.update_status_bar("Save cancelled.")
+
+    def on_export_error(self, message):
+        self._end_export()
+        QMessageBox.critical(self, "Save Error", message)
+        self.update_status_bar("Error: Failed to save file.")
 
     def on_parsing_finished(self, results):
         """
         Handles the successful completion of the parsing task.
-        Receives a tuple containing both the dictionary and the plain text.
+        Receives a tuple of the dictionary and its distinct strings.
         """
         self.thread.quit()
         self.thread.wait()
 
         # Unpack the results tuple
-        self.parsed_data_dict, self.parsed_data_text = results
+        self.parsed_data_dict, strings = results
 
         # --- USE THE CORRECT SETUP METHOD ---
         self.tree_model.setup_single_file_data(self.parsed_data_dict)
 
+        # Index the keys and values in the background; until it is ready the
+        # search bar falls back to matching row by row.
+        self.index_worker.set_task(self.parsed_data_dict, strings)
+        self.index_thread.start()
+
         self.save_json_action.setEnabled(True)
         self.save_text_action.setEnabled(True)
         self.compare_action.setEnabled(True)  # Enable the compare button
@@ -343,6 +568,20 @@ class MainWindow(QMainWindow):
                 self.tree_view.expand(child_index)
         # --- END OF AUTO-EXPAND LOGIC ---
 
+    def on_index_ready(self, index):
+        """Stores the finished search index and re-applies any active search."""
+        self.index_thread.quit()
+        self.index_thread.wait()
+        self.search_index = index
+        if self.search_bar.text():
+            self.filter_tree(self.search_bar.text())
+
+    def on_index_error(self, message):
+        """Searching still works without the index, just more slowly."""
+        self.index_thread.quit()
+        self.index_thread.wait()
+        self.update_status_bar("Search index unavailable; searching row by row.")
+
     def on_parsing_error(self, message):
         # This function remains unchanged
         self.thread.quit()
@@ -374,10 +613,12 @@ class MainWindow(QMainWindow):
                 f"Path: {path}\n"
                 f"Key: {item.key}\n"
                 f"Status: {item.status.name}\n"
+                f"{self._format_change_counts(item)}"
+                f"{self._format_change(item)}"
                 "--------------------\n"
-                f"Old Value (File 1):\n{item.value_a}\n"
+                f"Old Value (File 1):\n{self._format_value(item.value_a)}\n"
                 "--------------------\n"
-                f"New Value (File 2):\n{item.value_b}"
+                f"New Value (File 2):\n{self._format_value(item.value_b)}"
             )
             self.details_area.setText(details_text)
         elif not self.is_diff_mode and isinstance(item, TreeItem):
@@ -388,26 +629,103 @@ class MainWindow(QMainWindow):
             details_text = f"Path: {path}\n"
             details_text += f"Key: {key}\n"
             details_text += "--------------------\n"
-            if isinstance(value, (dict, list)):
-                try:
-                    value_str = json.dumps(value, indent=4)
-                except (TypeError, OverflowError):
-                    value_str = str(value)
-            else:
-                value_str = str(value)
-            details_text += f"Value:\n{value_str}"
+            details_text += f"Value:\n{self._format_value(value)}"
             self.details_area.setText(details_text)
 
+    def _format_value(self, value):
+        """Renders a value for the details pane. Dicts and lists are only
+        rendered here, when their node is selected."""
+        if isinstance(value, (dict, list)):
+            try:
+                return json.dumps(value, indent=4)
+            except (TypeError, OverflowError):
+                pass
+        return str(value)
+
+    def _format_change_counts(self, item):
+        """Describes the changes below a modified branch, for the details."""
+        counts = item.change_counts()
+        if counts is None:
+            return ""
+        return f"Changes below: {counts[0]} added, {counts[1]} removed, {counts[2]} modified\n"
+
+    def _format_change(self, item):
+        """Describes how much a modified number changed, for the details."""
+        if item.change is None:
+            return ""
+        delta, relative = item.change
+        if relative is None:
+            return f"Change: {delta:+g}\n"
+        return f"Change: {delta:+g} ({relative:+.1%})\n"
+
     def filter_tree(self, text):
-        # This function remains unchanged
+        self.cancel_search()
+        # Searches are answered by the index on the search thread, which only
+        # tests each distinct string once instead of every row of the tree,
+        # and never blocks the GUI.
+        query = None
+        if text and self.search_index is not None and not self.is_diff_mode:
+            try:
+                query = compile_search(text)
+            except (re.error, ValueError) as e:
+                # Shown rather than handed to the row by row filter below
+                self.update_status_bar(f"Invalid search: {e}")
+                return
+        if query is not None:
+            # When the new query can only match a subset of what the last one
+            # matched (e.g. a character was appended), just re-test those.
+            within = None
+            if self.last_search is not None and refines(query, self.last_search[0]):
+                within = self.last_search[1]
+            self.search_query = query
+            self.proxy_model.set_visible_ids(set())
+            self.update_status_bar(f"Searching for '{text}'...")
+            self.search_requested.emit(self.search_index, query, self.search_generation, within)
+            return
+        self.proxy_model.set_visible_ids(None)
         search = QRegularExpression(text, QRegularExpression.CaseInsensitiveOption)
         self.proxy_model.setFilterRegularExpression(search)
 
+    def on_search_text_changed(self, text):
+        """Stops the running search as soon as the text changes, and searches
+        for the new text once the user stops typing."""
+        self.cancel_search()
+        self.search_timer.start()
+
+    def cancel_search(self):
+        """Stops the background search, if one is running, without waiting
+        for it: its generation is out of date, so anything it still sends is
+        ignored."""
+        self.search_generation += 1
+        self.search_worker.cancel(self.search_generation)
+
+    def on_search_matches(self, generation, node_ids):
+        """Adds a batch of streamed matches to the view."""
+        if generation == self.search_generation:
+            self.proxy_model.add_visible_ids(node_ids)
+
+    def on_search_finished(self, generation, matches):
+        if generation != self.search_generation:
+            return  # A newer search has already been started
+        self.last_search = (self.search_query, sorted(matches))
+        self.update_status_bar(f"Search complete: {len(matches)} matches.")
+
+    def on_search_error(self, message):
+        QMessageBox.critical(self, "Search Error", message)
+
     def closeEvent(self, event):
-        # This function remains unchanged
-        if self.thread.isRunning():
-            self.thread.quit()
-            self.thread.wait()
+        self.cancel_search()
+        if self.compare_thread.isRunning():
+            self.compare_worker.cancel()
+        if self.timeline_thread.isRunning():
+            self.timeline_worker.cancel()
+        if self.export_thread.isRunning():
+            self.export_worker.cancel()
+        for thread in (self.thread, self.index_thread, self.search_thread, self.compare_thread,
+                       self.timeline_thread, self.export_thread):
+            if thread.isRunning():
+                thread.quit()
+                thread.wait()
         event.accept()
 
     def compare_file(self):
@@ -418,35 +736,159 @@ class MainWindow(QMainWindow):
         file_path_b, _ = QFileDialog.getOpenFileName(
             self, f"Compare '{Path(self.current_file_path).name}' With...",
             dir=self.settings.value("last_dir", self._get_default_save_path()),
-            filter="HOI4 Save Files (*.hoi4)"
+            filter=self.SAVE_FILTER
         )
 
-        if not file_path_b:
+        if not file_path_b or self.compare_thread.isRunning():
             return
 
-        # --- PARSE SECOND FILE WITH A PROGRESS DIALOG ---
-        # This prevents the UI from freezing during the second parse
-        progress = QProgressDialog("Parsing comparison file...", "Cancel", 0, 0, self)
+        # --- PARSE AND COMPARE ON THE WORKER THREAD ---
+        # The dialog keeps repainting and its Cancel button stops the worker
+        self.compare_progress = self._create_progress_dialog(
+            "Parsing comparison file...", self.compare_worker.cancel)
+
+        # The base file's parse is reused, and its digests are kept so that
+        # comparing it with several files only hashes it once.
+        if self.base_hasher is None:
+            self.base_hasher = SubtreeHasher(self.parsed_data_dict)
+        self.compare_worker.set_task(self.parsed_data_dict, self.base_hasher, file_path_b,
+                                     self.changes_only_action.isChecked())
+        self.compare_thread.start()
+
+    def _create_progress_dialog(self, label, cancel):
+        """Shows a percentage progress dialog whose Cancel button calls cancel."""
+        progress = QProgressDialog(label, "Cancel", 0, 100, self)
         progress.setWindowModality(Qt.WindowModal)
+        progress.setAutoReset(False)
+        progress.setAutoClose(False)
+        progress.canceled.connect(cancel)
         progress.show()
+        return progress
+
+    def on_comparison_progress(self, stage, percent):
+        if self.compare_progress is not None:
+            self.compare_progress.setLabelText(stage)
+            self.compare_progress.setValue(percent)
+
+    def _end_comparison(self):
+        """Stops the comparison thread and closes its progress dialog."""
+        self.compare_thread.quit()
+        self.compare_thread.wait()
+        if self.compare_progress is not None:
+            self.compare_progress.close()
+            self.compare_progress = None
+
+    def on_comparison_cancelled(self):
+        self._end_comparison()
+        self.update_status_bar("Comparison cancelled.")
+
+    def on_comparison_error(self, message):
+        self._end_comparison()
+        QMessageBox.critical(self, "Comparison Error", message)
+        self.update_status_bar("Error: Failed to compare files.")
 
-        try:
-            dict_b = load_as_dict(file_path_b)
-        except Exception as e:
-            QMessageBox.critical(self, "Parsing Error", f"Could not parse the comparison file:\n{e}")
-            progress.close()
+    def on_comparison_finished(self, diff_root):
+        """Called when the diff is ready to be displayed."""
+        self._end_comparison()
+        self.show_diff(diff_root)
+
+    def compare_timeline(self):
+        """Builds a timeline of the changes across a series of saves, such as
+        the autosaves of a campaign, and shows it in a separate window."""
+        if self.timeline_thread.isRunning():
             return
 
-        progress.setLabelText("Comparing files...")
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "Select Saves for the Timeline",
+            dir=self.settings.value("last_dir", self._get_default_save_path()),
+            filter=self.SAVE_FILTER
+        )
+        if len(file_paths) < 2:
+            if file_paths:
+                QMessageBox.information(self, "Timeline", "Please select at least two save files.")
+            return
 
-        # Now perform the diff
-        diff_root = compare_dicts(self.parsed_data_dict, dict_b)
-        self.on_comparison_finished(diff_root)
-        progress.close()
+        # Autosaves are written in rotation, so order the saves by age
+        file_paths.sort(key=lambda path: Path(path).stat().st_mtime)
+        self.timeline_names = [Path(path).name for path in file_paths]
+        self.timeline_progress = self._create_progress_dialog(
+            "Loading saves...", self.timeline_worker.cancel)
+        self.timeline_worker.set_task(file_paths)
+        self.timeline_thread.start()
+
+    def on_timeline_progress(self, stage, percent):
+        if self.timeline_progress is not None:
+            self.timeline_progress.setLabelText(stage)
+            self.timeline_progress.setValue(percent)
+
+    def _end_timeline(self):
+        """Stops the timeline thread and closes its progress dialog."""
+        self.timeline_thread.quit()
+        self.timeline_thread.wait()
+        if self.timeline_progress is not None:
+            self.timeline_progress.close()
+            self.timeline_progress = None
+
+    def on_timeline_cancelled(self):
+        self._end_timeline()
+        self.update_status_bar("Timeline cancelled.")
+
+    def on_timeline_error(self, message):
+        self._end_timeline()
+        QMessageBox.critical(self, "Timeline Error", message)
+        self.update_status_bar("Error: Failed to build the timeline.")
+
+    def on_timeline_finished(self, timeline):
+        """Shows every changed path with the saves it changed in."""
+        self._end_timeline()
+        data = {
+            path: [self.timeline_names[i] for i in indices]
+            for path, indices in sorted(timeline.items())
+        }
+
+        self.timeline_dialog = QDialog(self)
+        self.timeline_dialog.setWindowTitle(f"Timeline of {len(self.timeline_names)} Saves")
+        self.timeline_dialog.resize(800, 600)
+        layout = QVBoxLayout(self.timeline_dialog)
+        tree_view = QTreeView()
+        tree_view.setAlternatingRowColors(True)
+        model = TreeModel(self.timeline_dialog)
+        model.setup_single_file_data(data)
+        tree_view.setModel(model)
+        tree_view.setColumnWidth(0, 450)
+        layout.addWidget(tree_view)
+        self.timeline_dialog.show()
+        self.update_status_bar(f"Timeline complete: {len(data)} paths changed.")
+
+    def toggle_changes_only(self, checked):
+        """Shows the current comparison with or without unchanged entries.
+        Its digests, change counts and ranking are reused, so only the top
+        level is compared again."""
+        if not self.is_diff_mode:
+            return
+        self.show_diff(rebuild_diff_tree(self.diff_root, checked))
 
-    def on_comparison_finished(self, diff_root):
-        """Called when the diff is ready to be displayed."""
+    def toggle_largest_changes(self, checked):
+        """Switches between the comparison tree and a flat list of the numbers
+        that changed the most, largest first."""
+        if not self.is_diff_mode:
+            return
+        if checked:
+            self.tree_model.setup_diff_data(largest_changes_tree(self.diff_root))
+            self.tree_view.setColumnWidth(0, 400)
+            self.details_area.clear()
+        else:
+            self.show_diff(self.diff_root)
+
+    def show_diff(self, diff_root):
+        """Displays a comparison tree in the tree view."""
         self.is_diff_mode = True
+        self.diff_root = diff_root
+        self.largest_changes_action.setEnabled(True)
+        self.largest_changes_action.blockSignals(True)
+        self.largest_changes_action.setChecked(False)
+        self.largest_changes_action.blockSignals(False)
+        self.proxy_model.set_visible_ids(None)  # Node ids only exist in single-file mode
         self.tree_model.setup_diff_data(diff_root)
 
         # Update UI for diff mode
@@ -454,6 +896,7 @@ class MainWindow(QMainWindow):
         self.tree_view.setColumnWidth(0, 250)
         self.tree_view.setColumnWidth(1, 150)
         self.tree_view.setColumnWidth(2, 150)
+        self.tree_view.setColumnWidth(3, 150)
         self.legend_label.setVisible(True)
         self.details_area.clear()
         self.update_status_bar("Comparison complete. Green = Added, Red = Removed, Yellow = Modified.")
@@ -0,0 +1,114 @@
+"""Round trips of parsed saves through the binary encoder and the loader, and
+values patched in place in binary saves."""
+
+import io
+
+import pytest
+
+from hoi4.binary import patch_binary_hoi4, write_binary_hoi4
+from hoi4.parse import load_as_dict
+
+
+def encode_and_load(data, tmp_path):
+    path = tmp_path / "save.hoi4"
+    with open(path, "wb") as f:
+        write_binary_hoi4(data, f)
+    return load_as_dict(str(path))
+
+
+def write_save(path, *parts):
+    """Writes binary saves of each of the parts one after another, as a
+    single save, so that keys can be repeated within it."""
+    with open(path, "wb") as f:
+        for i, part in enumerate(parts):
+            encoded = io.BytesIO()
+            write_binary_hoi4(part, encoded)
+            f.write(encoded.getvalue()[7 if i else 0:])  # One HOI4bin header
+    return str(path)
+
+
+def test_values_round_trip(tmp_path):
+    data = {
+        "player": "GER",
+        "date": "1936.1.1.12",
+        "ironman": "no",
+        "manpower": "2255257",
+        "stability": "0.569",
+        "large": "4000000000",
+        "name": 'The "Big" One',
+        "flags": ["a", "b", "c"],
+    }
+    assert encode_and_load(data, tmp_path) == data
+
+
+def test_ids_round_trip(tmp_path):
+    data = {
+        "units": [
+            {"id": {"id": "0", "type": "53"}},
+            {"id": "two words", "name": "after a spaced id"},
+            {"id": "", "name": "after an empty id"},
+            {"id": "{", "name": "after a brace"},
+            {"id": 'a"b', "name": "after a quote"},
+        ],
+    }
+    assert encode_and_load(data, tmp_path) == data
+
+
+def test_flags_round_trip(flag_data, tmp_path):
+    assert encode_and_load(flag_data, tmp_path) == flag_data
+
+
+def test_patch_keeps_types(tmp_path):
+    path = write_save(tmp_path / "save.hoi4", {
+        "date": "1936.1.1.12",
+        "countries": {"GER": {"stability": "0.300", "manpower": "100", "ai": "yes"}},
+        "name": "short",
+        "title": "two words",
+    })
+    assert patch_binary_hoi4(path, ["countries", "GER", "stability"], "1") == "0.300"
+    assert patch_binary_hoi4(path, ["countries", "GER", "manpower"], "2255257") == "100"
+    assert patch_binary_hoi4(path, ["countries", "GER", "ai"], "no") == "yes"
+    assert patch_binary_hoi4(path, ["date"], "1940.5.10.6") == "1936.1.1.12"
+    # A longer string moves the rest of the file
+    assert patch_binary_hoi4(path, ["name"], "much_longer") == "short"
+    assert patch_binary_hoi4(path, ["title"], "three more words") == "two words"
+    assert load_as_dict(path) == {
+        "date": "1940.5.10.6",
+        "countries": {"GER": {"stability": "1.000", "manpower": "2255257", "ai": "no"}},
+        "name": "much_longer",
+        "title": "three more words",
+    }
+
+
+@pytest.mark.parametrize("keys, value", [
+    (["stability"], "0.0001"),
+    (["stability"], "high"),
+    (["manpower"], "1.5"),
+    (["manpower"], "3000000000"),
+    (["ai"], "1"),
+    (["name"], "two words"),  # Only a quoted string can hold spaces
+])
+def test_patch_refuses_other_types(tmp_path, keys, value):
+    data = {"stability": "0.300", "manpower": "100", "ai": "yes", "name": "short"}
+    path = write_save(tmp_path / "save.hoi4", data)
+    with pytest.raises(ValueError):
+        patch_binary_hoi4(path, keys, value)
+    assert load_as_dict(path) == data
+
+
+def test_patch_repeated_keys(tmp_path):
+    path = write_save(tmp_path / "save.hoi4",
+                      {"x": "1", "block": {"y": "3"}}, {"x": "2", "block": {"y": "4"}})
+    assert load_as_dict(path) == {"x": "2", "block": {"y": "4"}}
+    # The last of each is patched, as it is the one the parsed save holds
+    assert patch_binary_hoi4(path, ["x"], "99") == "2"
+    assert patch_binary_hoi4(path, ["block", "y"], "7") == "4"
+    assert load_as_dict(path) == {"x": "99", "block": {"y": "7"}}
+
+
+def test_patch_missing_key(tmp_path):
+    path = write_save(tmp_path / "save.hoi4", {"countries": {"GER": {"stability": "0.300"}}})
+    with pytest.raises(KeyError):
+        patch_binary_hoi4(path, ["countries", "ENG", "stability"], "1")
+    with pytest.raises(ValueError):
+        patch_binary_hoi4(path, ["countries", "GER"], "1")  # A block
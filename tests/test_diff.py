@@ -0,0 +1,61 @@
+"""JSON Patches of the differences between parsed saves."""
+
+import copy
+
+from diff_logic import iter_patch
+
+
+def apply_patch(document, patch):
+    """Applies RFC 6902 add, remove and replace operations, in order."""
+    document = copy.deepcopy(document)
+    for operation in patch:
+        keys = [key.replace("~1", "/").replace("~0", "~") for key in operation["path"].split("/")[1:]]
+        parent = document
+        for key in keys[:-1]:
+            parent = parent[int(key)] if isinstance(parent, list) else parent[key]
+        key = int(keys[-1]) if isinstance(parent, list) else keys[-1]
+        if operation["op"] == "remove":
+            del parent[key]
+        elif operation["op"] == "add" and isinstance(parent, list):
+            parent.insert(key, operation["value"])
+        else:
+            parent[key] = operation["value"]
+    return document
+
+
+def test_patch_of_same_save_is_empty():
+    data = {"countries": {"GER": {"stability": "0.569"}}, "flags": ["a", "b"]}
+    assert list(iter_patch(data, copy.deepcopy(data))) == []
+
+
+def test_patch_changes_values_in_place():
+    old = {"countries": {"GER": {"stability": "0.569", "manpower": "100"}, "ENG": {"a": "1"}}}
+    new = {"countries": {"GER": {"stability": "0.600", "manpower": "100"}, "FRA": {"a": "1"}}}
+    patch = list(iter_patch(old, new))
+    assert {"op": "replace", "path": "/countries/GER/stability", "value": "0.600"} in patch
+    assert {"op": "remove", "path": "/countries/ENG"} in patch
+    assert {"op": "add", "path": "/countries/FRA", "value": {"a": "1"}} in patch
+    assert apply_patch(old, patch) == new
+
+
+def test_patch_of_lists():
+    old = {
+        "divisions": [{"id": "1", "strength": "1.000"}, {"id": "2", "strength": "0.500"},
+                      {"id": "3", "strength": "0.900"}],
+        "flags": ["a", "b", "c", "d"],
+    }
+    new = {
+        "divisions": [{"id": "2", "strength": "0.400"}, {"id": "3", "strength": "0.900"},
+                      {"id": "4", "strength": "1.000"}],
+        "flags": ["a", "x", "c", "d", "e"],
+    }
+    patch = list(iter_patch(old, new))
+    # Divisions are matched by id, so only the one that changed is replaced
+    assert {"op": "replace", "path": "/divisions/0/strength", "value": "0.400"} in patch
+    assert apply_patch(old, patch) == new
+
+
+def test_patch_escapes_keys():
+    old = {"a/b": {"c~d": "1"}}
+    new = {"a/b": {"c~d": "2"}}
+    assert list(iter_patch(old, new)) == [{"op": "replace", "path": "/a~1b/c~0d", "value": "2"}]
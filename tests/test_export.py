@@ -0,0 +1,43 @@
+"""Round trips of parsed saves through the plain text writer and the parser."""
+
+import io
+
+from hoi4.export import write_hoi4
+from hoi4.plain import filestring_to_dict
+
+
+def write_and_parse(data):
+    f = io.StringIO()
+    write_hoi4(data, f)
+    return filestring_to_dict(f.getvalue())
+
+
+def test_flags_round_trip(flag_data):
+    assert write_and_parse(flag_data) == flag_data
+
+
+def test_quoted_strings_round_trip():
+    data = {
+        "name": 'The "Big" One',
+        "path": "C:\\saves\\autosave",
+        "trailing": "ends with \\",
+        "spaced": "two words",
+        "empty": "",
+        "tokens": ["{", "}", "=", 'a"b'],
+        "key with spaces": "yes",
+    }
+    assert write_and_parse(data) == data
+
+
+def test_blocks_round_trip():
+    data = {
+        "units": [
+            {"id": {"id": "0", "type": "53"}, "name": "0. Infanterie", "strength": "0.802"},
+            {"id": {"id": "1", "type": "53"}, "name": "1. Infanterie", "strength": "0.063"},
+        ],
+        "flags": ["a", "b", "c"],
+        "empty": {},
+        "after_empty": "value",
+        "mixed": ["1", {"x": "2"}, ["3", "4"]],
+    }
+    assert write_and_parse(data) == data
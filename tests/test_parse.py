@@ -0,0 +1,91 @@
+"""Loading and probing saves, plain or binary, compressed or not."""
+
+import bz2
+import gzip
+import io
+import lzma
+import zipfile
+
+import pytest
+
+from hoi4.binary import write_binary_hoi4
+from hoi4.export import write_hoi4
+from hoi4.parse import load_as_dict, probe
+
+SAVE = {
+    "player": "GER",
+    "ideology": "fascism",
+    "date": "1936.1.1.12",
+    "version": "Barbarossa v1.15.3",
+    "ironman": "yes",
+    "countries": {"GER": {"stability": "0.569", "date": "1936.3.1.1"}},
+}
+
+
+def encode(data, save_type):
+    if save_type == "binary":
+        f = io.BytesIO()
+        write_binary_hoi4(data, f)
+        return f.getvalue()
+    f = io.StringIO()
+    write_hoi4(data, f)
+    return b"HOI4txt\n" + f.getvalue().encode("utf-8")
+
+
+def compress(data, compression):
+    if compression == "gzip":
+        return gzip.compress(data)
+    if compression == "bz2":
+        return bz2.compress(data)
+    if compression == "xz":
+        return lzma.compress(data)
+    if compression == "zip":
+        f = io.BytesIO()
+        with zipfile.ZipFile(f, "w") as archive:
+            archive.writestr("save.hoi4", data)
+        return f.getvalue()
+    return data
+
+
+@pytest.fixture(params=["plain", "binary"])
+def save_type(request):
+    return request.param
+
+
+@pytest.fixture(params=[None, "gzip", "bz2", "xz", "zip"])
+def save_path(request, save_type, tmp_path):
+    path = tmp_path / "save.hoi4"
+    path.write_bytes(compress(encode(SAVE, save_type), request.param))
+    return str(path)
+
+
+def test_load(save_path):
+    assert load_as_dict(save_path) == SAVE
+
+
+def test_probe(save_path, save_type):
+    assert probe(save_path) == {
+        "player": "GER",
+        "date": "1936.1.1.12",
+        "version": "Barbarossa v1.15.3",
+        "ironman": True,
+        "save_type": save_type,
+    }
+
+
+def test_probe_reads_only_the_start(save_type, tmp_path):
+    # Metadata after the first block, or past the bytes read, is not found
+    data = {"player": "GER", "countries": {"GER": {}}, "version": "late"}
+    path = tmp_path / "save.hoi4"
+    path.write_bytes(encode(data, save_type))
+    metadata = probe(str(path))
+    assert metadata["player"] == "GER"
+    assert metadata["version"] is None
+    assert probe(str(path), size=9)["player"] is None
+
+
+def test_probe_refuses_other_files(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes(b"player = GER")
+    with pytest.raises(ValueError):
+        probe(str(path))
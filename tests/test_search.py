@@ -0,0 +1,63 @@
+"""Searches of parsed saves through the search index."""
+
+import re
+
+import pytest
+
+from hoi4.search import SearchIndex, compile_search, refines
+
+SAVE = {
+    "countries": {
+        "GER": {"stability": "0.569", "manpower": "2255257", "name": "Germany"},
+        "ENG": {"stability": "0.793", "manpower": "900", "name": "England"},
+    },
+    "flags": ["ger_flag", "other"],
+}
+
+
+def search(text, within=None):
+    index = SearchIndex(SAVE)
+    return {index.path(node_id) for node_id in index.search(compile_search(text), within)}
+
+
+def test_text_matches_keys_and_values():
+    assert search("ger") == {"countries.GER", "countries.GER.name", "flags.[0]"}
+
+
+def test_regex():
+    assert search("^G.*y$") == {"countries.GER.name"}
+
+
+@pytest.mark.parametrize("text, paths", [
+    ("key:stability value>0.6", {"countries.ENG.stability"}),
+    ("value=900", {"countries.ENG.manpower"}),
+    ("key:man* value>=900", {"countries.ENG.manpower", "countries.GER.manpower"}),
+    ("path:countries.*. key:name", {"countries.ENG.name", "countries.GER.name"}),
+    ('value:"Ger*y"', {"countries.GER.name"}),
+])
+def test_structured_queries(text, paths):
+    assert search(text) == paths
+
+
+def test_within_limits_the_nodes_tested():
+    index = SearchIndex(SAVE)
+    first = index.search(compile_search("g"))
+    assert index.search(compile_search("ger"), first) == index.search(compile_search("ger"))
+    assert index.search(compile_search("ger"), set()) == set()
+
+
+def test_invalid_queries():
+    with pytest.raises(ValueError):
+        compile_search("value>abc")
+    with pytest.raises(ValueError):
+        compile_search("key>1")
+    with pytest.raises(re.error):
+        compile_search("a[")
+
+
+def test_refines():
+    assert refines(compile_search("germ"), compile_search("ger"))
+    assert not refines(compile_search("ger"), compile_search("germ"))
+    assert refines(compile_search("key:name value:G*"), compile_search("key:name"))
+    assert not refines(compile_search("key:name"), compile_search("key:name value:G*"))
+    assert not refines(compile_search("ger"), None)
@@ -4,15 +4,24 @@ from PySide6.QtCore import QAbstractItemModel, QModelIndex, Qt
 from PySide6.QtGui import QColor
 
 from diff_logic import DiffNode, DiffStatus
+from hoi4.search import iter_nodes
+
+
+def display_value(value):
+    """Returns the text shown for a value in the tree: dicts and lists are
+    summarised, as their contents are shown by their own rows."""
+    if isinstance(value, (dict, list)): return f"[{len(value)} items]"
+    return str(value)
 
 
 class TreeItem:
     """A helper class to represent a node in the single-file tree model."""
 
-    def __init__(self, key, value, parent=None):
+    def __init__(self, key, value, parent=None, node_id=-1):
         self._parent = parent
         self._key = key
         self._value = value
+        self._id = node_id  # Matches the node ids used by the SearchIndex
         self._children = []
 
     def appendChild(self, item):
@@ -68,21 +77,37 @@ class TreeModel(QAbstractItemModel):
         self.endResetModel()
 
     def _populate_tree(self, data, parent):
-        if isinstance(data, dict):
-            for key, value in data.items():
-                child_item = TreeItem(str(key), value, parent)
-                parent.appendChild(child_item)
-                if isinstance(value, (dict, list)):
-                    self._populate_tree(value, child_item)
-        elif isinstance(data, list):
-            for i, value in enumerate(data):
-                child_item = TreeItem(f"[{i}]", value, parent)
-                parent.appendChild(child_item)
-                if isinstance(value, (dict, list)):
-                    self._populate_tree(value, child_item)
+        # Walk the data in the same order as the SearchIndex does, so that
+        # every TreeItem gets the same node id as its entry in the index.
+        items = []
+        for node_id, parent_id, key, value in iter_nodes(data):
+            parent_item = items[parent_id] if parent_id >= 0 else parent
+            child_item = TreeItem(key, value, parent_item, node_id)
+            parent_item.appendChild(child_item)
+            items.append(child_item)
+
+    def hasChildren(self, parent=QModelIndex()):
+        parentItem = parent.internalPointer() if parent.isValid() else self._rootItem
+        if isinstance(parentItem, DiffNode) and parentItem.canFetchMore():
+            return True  # Its children are diffed when it is expanded
+        return parentItem.childCount() > 0
+
+    def canFetchMore(self, parent):
+        if not parent.isValid(): return False
+        item = parent.internalPointer()
+        return isinstance(item, DiffNode) and item.canFetchMore()
+
+    def fetchMore(self, parent):
+        item = parent.internalPointer()
+        children = item.fetchMore()
+        if not children: return
+        self.beginInsertRows(parent, 0, len(children) - 1)
+        for child in children:
+            item.appendChild(child)
+        self.endInsertRows()
 
     def columnCount(self, parent=QModelIndex()):
-        return 3 if self.is_diff_mode else 2
+        return 4 if self.is_diff_mode else 2
 
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid(): return None
@@ -91,13 +116,19 @@ class TreeModel(QAbstractItemModel):
         if role == Qt.DisplayRole:
             if isinstance(item, TreeItem):
                 if index.column() == 0: return item._key
-                if index.column() == 1:
-                    if isinstance(item._value, (dict, list)): return f"[{len(item._value)} items]"
-                    return str(item._value)
+                if index.column() == 1: return display_value(item._value)
             elif isinstance(item, DiffNode):
                 if index.column() == 0: return item.key
-                if index.column() == 1: return str(item.value_b)
-                if index.column() == 2: return str(item.value_a)
+                if index.column() == 1: return display_value(item.value_b)
+                if index.column() == 2: return display_value(item.value_a)
+                if index.column() == 3:
+                    # How much a number changed, or the changes below a branch
+                    if item.change is not None:
+                        delta, relative = item.change
+                        if relative is None: return f"{delta:+g}"
+                        return f"{delta:+g} ({relative:+.1%})"
+                    counts = item.change_counts()
+                    if counts: return f"+{counts[0]} -{counts[1]} ~{counts[2]}"
 
         if role == Qt.BackgroundRole and self.is_diff_mode and isinstance(item, DiffNode):
             if item.status == DiffStatus.ADDED: return QColor("#1a421a")
@@ -112,6 +143,7 @@ class TreeModel(QAbstractItemModel):
             if self.is_diff_mode:
                 if section == 1: return "New Value (File 2)"
                 if section == 2: return "Old Value (File 1)"
+                if section == 3: return "Change"
             else:
                 if section == 1: return "Value"
         return None
@@ -1,6 +1,15 @@
+import os
+import time
 import traceback
 from PySide6.QtCore import QObject, Signal, Slot
 from hoi4.parse import load_as_text, filestring_to_dict
+from hoi4.search import SearchIndex
+from hoi4.export import open_export, export_compression
+from diff_logic import compare_dicts, build_timeline
+
+
+class CancelledError(Exception):
+    """Raised from a progress callback to stop a task the user cancelled."""
 
 
 class Worker(QObject):
@@ -8,7 +17,7 @@ class Worker(QObject):
     A worker object that runs in a separate thread to handle long-running tasks
     like file parsing, ensuring the GUI remains responsive.
     """
-    # Signal now emits a tuple: (dictionary, plain_text)
+    # Signal now emits a tuple: (dictionary, distinct strings)
     result_ready = Signal(tuple)
 
     # Signal emitted to update the status bar with progress messages
@@ -30,7 +39,8 @@ class Worker(QObject):
     def run(self):
         """
         Executes the parsing task. It first gets the plain text, then creates
-        the dictionary from it, and finally emits both as a tuple.
+        the dictionary from it, and emits the dictionary. The text itself is
+        not kept: plain text exports decode the file again.
         """
         try:
             self.progress.emit(f"Parsing {self._file_path}...")
@@ -40,15 +50,323 @@ class Worker(QObject):
             plain_text = load_as_text(self._file_path)
 
             # Step 2: Create the dictionary from the plain text.
-            # This is much faster than parsing the file a second time.
-            data_dict = filestring_to_dict(plain_text)
+            # This is much faster than parsing the file a second time. The
+            # distinct strings are collected on the way for the search index.
+            strings = {}
+            data_dict = filestring_to_dict(plain_text, strings)
+            del plain_text
 
-            # Step 3: Emit both results together in a tuple.
-            self.result_ready.emit((data_dict, plain_text))
+            # Step 3: Emit the results together in a tuple.
+            self.result_ready.emit((data_dict, strings))
 
             self.progress.emit("Parsing complete.")
 
         except Exception as e:
             # If any error occurs, emit the error signal with a detailed message
             error_message = f"Error parsing file: {e}\n{traceback.format_exc()}"
-            self.error.emit(error_message)
\ No newline at end of file
+            self.error.emit(error_message)
+
+class IndexWorker(QObject):
+    """
+    A worker object that builds the search index for a parsed save in a
+    separate thread, so the tree can be browsed while the index is built.
+    """
+    # Signal emitted with the finished SearchIndex
+    index_ready = Signal(object)
+
+    # Signal emitted when an error occurs during the task
+    error = Signal(str)
+
+    def __init__(self):
+        super().__init__()
+        self._data = None
+        self._strings = None
+
+    def set_task(self, data, strings=None):
+        """Sets the parsed data to be indexed, and optionally the distinct
+        strings collected while parsing it."""
+        self._data = data
+        self._strings = strings
+
+    @Slot()
+    def run(self):
+        """Builds the index and emits it."""
+        try:
+            index = SearchIndex(self._data, self._strings)
+            self._data = self._strings = None
+            self.index_ready.emit(index)
+        except Exception as e:
+            error_message = f"Error building search index: {e}\n{traceback.format_exc()}"
+            self.error.emit(error_message)
+
+
+class SearchWorker(QObject):
+    """
+    A worker object that runs searches against the SearchIndex in a separate
+    thread. Its thread keeps running between searches, and each search is a
+    queued call of run. Matches are streamed back in batches while the search
+    runs, and a search can be cancelled from the GUI thread at any time
+    without waiting for it.
+    """
+    # Signal emitted with (generation, list of newly visible node ids)
+    matches_found = Signal(int, object)
+
+    # Signal emitted with (generation, list of matching node ids) when a
+    # search runs to completion
+    finished = Signal(int, object)
+
+    # Signal emitted when an error occurs during the task
+    error = Signal(str)
+
+    # Minimum number of seconds between two batches of matches
+    EMIT_INTERVAL = 0.1
+
+    def __init__(self):
+        super().__init__()
+        self._newest = 0  # Searches of older generations stop
+
+    def cancel(self, generation):
+        """Asks every search older than generation to stop, including any
+        still queued. Safe to call from any thread."""
+        self._newest = generation
+
+    @Slot(object, object, int, object)
+    def run(self, index, query, generation, within=None):
+        """Searches the index for a query, optionally testing only the given
+        node ids, and emits the visible ids as they are found. The generation
+        is passed back with every signal so that stale results can be
+        ignored."""
+        try:
+            visible = set()
+            matches = []
+            pending = []
+            last_emit = 0.0
+            # The index yields a batch, if only an empty one, every so often
+            for batch in index.iter_search(query, within):
+                if generation < self._newest:
+                    return
+                matches.extend(batch)
+                pending.extend(index.add_ancestors(batch, visible))
+                if pending and time.monotonic() - last_emit >= self.EMIT_INTERVAL:
+                    self.matches_found.emit(generation, pending)
+                    pending = []
+                    last_emit = time.monotonic()
+            if generation < self._newest:
+                return
+            if pending:
+                self.matches_found.emit(generation, pending)
+            self.finished.emit(generation, matches)
+        except Exception as e:
+            error_message = f"Error searching: {e}\n{traceback.format_exc()}"
+            self.error.emit(error_message)
+
+
+class CompareWorker(QObject):
+    """
+    A worker object that parses a second save file and compares it with the
+    already parsed base file in a separate thread, reporting progress as it
+    goes. The comparison can be cancelled from the GUI thread at any time.
+    """
+    # Signal emitted with the root DiffNode of the finished comparison
+    result_ready = Signal(object)
+
+    # Signal emitted with (stage description, percentage complete)
+    progress = Signal(str, int)
+
+    # Signal emitted when the comparison stopped because it was cancelled
+    cancelled = Signal()
+
+    # Signal emitted when an error occurs during the task
+    error = Signal(str)
+
+    def __init__(self):
+        super().__init__()
+        self._dict_a = None
+        self._hasher_a = None
+        self._file_path = ""
+        self._changes_only = False
+        self._cancelled = False
+
+    def set_task(self, dict_a, hasher_a, file_path, changes_only=False):
+        """Sets the parsed base file, its SubtreeHasher, the path of the file
+        to compare it with and whether to leave out unchanged entries."""
+        self._dict_a = dict_a
+        self._hasher_a = hasher_a
+        self._file_path = file_path
+        self._changes_only = changes_only
+        self._cancelled = False
+
+    def cancel(self):
+        """Asks the running comparison to stop. Safe to call from any thread."""
+        self._cancelled = True
+
+    def _check_cancelled(self):
+        """Stops the task if it has been cancelled."""
+        if self._cancelled:
+            raise CancelledError()
+
+    def _reporter(self, stage, start, end):
+        """Returns a progress callback that maps its (done, total) onto the
+        start to end percentage range, and stops the task if cancelled."""
+        def report(done, total):
+            self._check_cancelled()
+            fraction = done / total if total else 1
+            self.progress.emit(stage, int(start + (end - start) * fraction))
+        return report
+
+    @Slot()
+    def run(self):
+        """Parses the second file, compares it and emits the diff tree."""
+        try:
+            stage = f"Reading {self._file_path}..."
+            plain_text = load_as_text(self._file_path, self._reporter(stage, 0, 40))
+            # Repeated strings are stored once, which saves much of the
+            # memory of holding a second save
+            dict_b = filestring_to_dict(
+                plain_text, {}, progress=self._reporter("Building tree...", 40, 60)
+            )
+            del plain_text
+            diff_root = compare_dicts(
+                self._dict_a, dict_b, self._hasher_a,
+                progress=self._reporter("Comparing sections...", 60, 90),
+                changes_only=self._changes_only
+            )
+            # Count the changes below every modified branch and rank the
+            # largest numeric changes now, so the view can show them without
+            # walking the whole comparison on the GUI thread.
+            context = diff_root._context
+            self.progress.emit("Counting the changes...", 90)
+            context.count_changes(diff_root.value_a, diff_root.value_b, self._check_cancelled)
+            self.progress.emit("Ranking the largest changes...", 95)
+            context.largest_changes(check=self._check_cancelled)
+            self.result_ready.emit(diff_root)
+        except CancelledError:
+            self.cancelled.emit()
+        except Exception as e:
+            error_message = f"Could not compare the files: {e}\n{traceback.format_exc()}"
+            self.error.emit(error_message)
+        finally:
+            self._dict_a = self._hasher_a = None
+
+
+class TimelineWorker(QObject):
+    """
+    A worker object that builds a timeline of changes across a series of save
+    files in a separate thread, loading one file at a time.
+    """
+    # Signal emitted with the timeline, mapping paths to save indices
+    result_ready = Signal(object)
+
+    # Signal emitted with (stage description, percentage complete)
+    progress = Signal(str, int)
+
+    # Signal emitted when the timeline stopped because it was cancelled
+    cancelled = Signal()
+
+    # Signal emitted when an error occurs during the task
+    error = Signal(str)
+
+    def __init__(self):
+        super().__init__()
+        self._file_paths = []
+        self._cancelled = False
+
+    def set_task(self, file_paths):
+        """Sets the save files to compare, in chronological order."""
+        self._file_paths = file_paths
+        self._cancelled = False
+
+    def cancel(self):
+        """Asks the running task to stop. Safe to call from any thread."""
+        self._cancelled = True
+
+    def _load_saves(self):
+        """Yields the parsed saves one by one, reporting progress."""
+        count = len(self._file_paths)
+        for i, file_path in enumerate(self._file_paths):
+            if self._cancelled:
+                raise CancelledError()
+            self.progress.emit(f"Loading save {i + 1} of {count}...", 100 * i // count)
+            yield filestring_to_dict(load_as_text(file_path))
+
+    @Slot()
+    def run(self):
+        """Builds the timeline and emits it."""
+        try:
+            self.result_ready.emit(build_timeline(self._load_saves()))
+        except CancelledError:
+            self.cancelled.emit()
+        except Exception as e:
+            error_message = f"Could not build the timeline: {e}\n{traceback.format_exc()}"
+            self.error.emit(error_message)
+
+
+class ExportWorker(QObject):
+    """
+    A worker object that writes an export file in a separate thread. The file
+    is written under a temporary name next to the target and only renamed
+    over it once complete, so a cancelled or failed export leaves any
+    existing file untouched. The export can be cancelled at any time.
+    """
+    # Signal emitted with the path of the finished file
+    finished = Signal(str)
+
+    # Signal emitted with the number of characters written so far. Exports
+    # can pass the 2**31 that fits in a C int, so the count is a Python int.
+    progress = Signal(object)
+
+    # Signal emitted when the export stopped because it was cancelled
+    cancelled = Signal()
+
+    # Signal emitted when an error occurs during the task
+    error = Signal(str)
+
+    def __init__(self):
+        super().__init__()
+        self._file_path = ""
+        self._write = None
+        self._cancelled = False
+
+    def set_task(self, file_path, write):
+        """Sets the file to export to, and the function that writes it. The
+        function is called with an open text file and a progress callback,
+        which takes the number of characters written so far."""
+        self._file_path = file_path
+        self._write = write
+        self._cancelled = False
+
+    def cancel(self):
+        """Asks the running export to stop. Safe to call from any thread."""
+        self._cancelled = True
+
+    def _report(self, written):
+        if self._cancelled:
+            raise CancelledError()
+        self.progress.emit(written)
+
+    @Slot()
+    def run(self):
+        """Writes the export to a temporary file and renames it into place."""
+        temp_path = self._file_path + ".part"
+        try:
+            # The target's extension says whether to compress the file
+            with open_export(temp_path, export_compression(self._file_path)) as f:
+                self._write(f, self._report)
+            os.replace(temp_path, self._file_path)
+            self.finished.emit(self._file_path)
+        except CancelledError:
+            self._remove(temp_path)
+            self.cancelled.emit()
+        except Exception as e:
+            self._remove(temp_path)
+            error_message = f"Could not save {self._file_path}: {e}\n{traceback.format_exc()}"
+            self.error.emit(error_message)
+        finally:
+            self._write = None
+
+    def _remove(self, temp_path):
+        """Removes a partly written temporary file, if there is one."""
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass